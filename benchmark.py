@@ -0,0 +1,270 @@
+"""
+benchmark of the acquisition cycle times, against the simulated
+instruments (see simulators.py).
+
+Each entry point is called a number of times; for each the wall time
+is split into time spent in time.sleep, time spent in (simulated)
+instrument I/O, and the rest (computation). Times are in the
+simulated instruments' seconds, so the simulation can run faster than
+real time (rate) without changing the numbers, apart from the
+computation, which is measured in real time. Code that talks to
+several instruments from several threads spends sleep and io in each
+of them, so those can add up to more than the wall time; regressions
+are judged on the wall time.
+
+    python benchmark.py -o run.json
+    python benchmark.py -o new.json --compare run.json
+"""
+import sys, os, time, json, tempfile, platform
+import numpy
+import simulators
+
+# entry points: name, and a function that sets things up and returns
+# the callable to time. The modules are imported here, after the
+# simulators have been installed.
+def setupKerrmonitor():
+    import kerrmonitor
+    return kerrmonitor.polarization
+def setupLockinamp2x():
+    import lockinamp2x
+    return lambda: lockinamp2x.polarization(1.0)
+def setupLockin2all():
+    import lockin2all
+    return lockin2all.getvalue
+def setupScope():
+    import instruments
+    scope = instruments.Scope()
+    return scope.readWaveform
+def setupDedicated():
+    import lockin2all
+    lockin2all.setharmonics()
+    lockin2all.crosscalibrate()
+    return lockin2all.getpolarization
+def setupSoftlockin():
+    import instruments, softlockin
+    scope = instruments.Scope(chs=(1,2))
+    # 2-byte points; the 1f signal is below one 8-bit step
+    scope.setWindow(width=2)
+    return lambda: softlockin.readPolarization(scope, 50e3)
+def setupDMM():
+    import instruments
+    dmm = instruments.DMM(mode=2)
+    return dmm.update
+def setupOven():
+    import oven
+    return oven.Oven().getT
+
+ENTRIES = (
+    ('kerrmonitor.polarization', setupKerrmonitor),
+    ('lockinamp2x.polarization', setupLockinamp2x),
+    ('lockin2all.getvalue', setupLockin2all),
+    ('lockin2all.getpolarization', setupDedicated),
+    ('Scope.readWaveform', setupScope),
+    ('softlockin.readPolarization', setupSoftlockin),
+    ('DMM.update', setupDMM),
+    ('Oven.getT', setupOven))
+
+class SleepCounter:
+    """
+    stands in for time.sleep: adds up the requested time and sleeps on
+    the simulation clock
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.total = 0.
+    def __call__(self, seconds):
+        self.total += seconds
+        self.clock.sleep(seconds)
+
+def measure(func, bench, sleeper, iterations, workdir):
+    """
+    call func iterations times; returns the mean time per call split
+    into sleep, io and compute, plus transactions and per-device io
+    """
+    bench.stats.reset()
+    sleeper.total = 0.
+    start = time.time()
+    realStart = simulators.realtime()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for j in range(iterations):
+            # the lock-in scripts chdir to C:\lockindata (relative off
+            # Windows) on every call
+            os.chdir(workdir)
+            func()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    real = simulators.realtime() - realStart
+    rate = getattr(bench.clock, 'rate', 1.)
+    # computation is whatever real time was not spent waiting
+    compute = max(real - (sleeper.total + bench.stats.io) / rate, 0.)
+    n = float(iterations)
+    devices = {}
+    for (name, (seconds, count)) in bench.stats.devices.items():
+        devices[name] = {'io': seconds / n, 'transactions': count / n}
+    return {'iterations': iterations,
+            'wall': (time.time() - start) / n,
+            'sleep': sleeper.total / n,
+            'io': bench.stats.io / n,
+            'compute': compute / n,
+            'total': (sleeper.total + bench.stats.io + compute) / n,
+            'transactions': bench.stats.transactions / n,
+            'devices': devices}
+
+def run(names=None, iterations=3, rate=100., latency=None):
+    """
+    run the benchmarks (all of ENTRIES if names is None); returns the
+    results as a dict ready to be written out as JSON
+    """
+    clock = simulators.VirtualClock(rate)
+    bench = simulators.install(clock=clock, latency=latency)
+    sleeper = SleepCounter(clock)
+    workdir = tempfile.mkdtemp()
+    if os.sep != '\\':
+        # link back to workdir, so chdir can be repeated
+        os.symlink('.', os.path.join(workdir, 'C:\\lockindata'))
+    cwd = os.getcwd()
+    # code under test sees the simulation clock
+    (sleep, now) = (time.sleep, time.time)
+    time.sleep = sleeper
+    time.time = clock.time
+    results = {}
+    try:
+        for (name, setup) in ENTRIES:
+            if (names is not None) and (name not in names):
+                continue
+            os.chdir(workdir)
+            func = setup()
+            results[name] = measure(func, bench, sleeper, iterations,
+                                    workdir)
+    finally:
+        (time.sleep, time.time) = (sleep, now)
+        os.chdir(cwd)
+    return {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'rate': rate,
+            'iterations': iterations,
+            'results': results}
+
+def ovenRamp(series, rate=300., band=0.5, configure=None):
+    """
+    run OvenControl.rampSeries(series) on the simulated oven
+    (simulators.OvenPlant) with a clock rate times faster than real
+    time; much faster and thread scheduling delays start to show up as
+    seconds of relay timing error. configure, if given, is called with
+    the OvenControl before it starts (e.g. to select the controller).
+    For each (target, duration, stay) of the series, returns a dict
+    with the time from the end of the ramp until the temperature stays
+    within band of the target ('settle', None if never), the largest
+    deviation during the stay ('overshoot') and the rms deviation after
+    settling ('ripple').
+    """
+    clock = simulators.VirtualClock(rate)
+    bench = simulators.install(clock=clock, oven=simulators.OvenPlant())
+    import oven
+    logfile = tempfile.mktemp()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        ovenObj = oven.Oven(clock=clock)
+        ovenObj.mode = 'burst'
+        ovenObj.samples = 10
+        control = oven.OvenControl(ovenObj, logfile)
+        if configure is not None:
+            configure(control)
+        control.start()
+        # let the controller take its first reading
+        while not hasattr(ovenObj, 'T'):
+            clock.sleep(1)
+        start = clock.time()
+        control.rampSeries(series)
+        control.running = False
+        control.join()
+        ovenObj.offRelay()
+        control.log.flush()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    log = numpy.loadtxt(logfile, delimiter=',', ndmin=2)
+    os.remove(logfile)
+    results = []
+    for (target, duration, stay) in series:
+        # the ramp is over when the setpoint reaches the target
+        after = log[log[:,0] >= start]
+        # the setpoint is read back from the log, so it may be rounded
+        reached = after[abs(after[:,2] - target) < 1e-6*max(1, abs(target))]
+        if len(reached) == 0:
+            raise Exception, "setpoint never reached %g in the log" % target
+        end = reached[0,0]
+        hold = log[(log[:,0] >= end) & (log[:,0] <= end + stay)]
+        deviation = hold[:,1] - target
+        outside = numpy.nonzero(abs(deviation) > band)[0]
+        settle = 0.
+        if len(outside) > 0:
+            if outside[-1] == len(hold) - 1:
+                settle = None
+            else:
+                settle = hold[outside[-1]+1,0] - end
+        settled = hold[hold[:,0] >= end + (settle or 0.)]
+        results.append({'target': target,
+                        'settle': settle,
+                        'overshoot': float(numpy.max(abs(deviation))),
+                        'ripple': float(numpy.sqrt(numpy.mean(
+                            (settled[:,1] - target)**2)))})
+        start = end + stay
+    return results
+
+def compare(old, new, tolerance=0.1):
+    """
+    compare two results of run(); returns a list of (name, old wall
+    time, new wall time, relative change) for entries that got slower
+    by more than tolerance
+    """
+    slower = []
+    for (name, result) in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['wall']
+        after = result['wall']
+        if before > 0 and (after - before) / before > tolerance:
+            slower.append((name, before, after, (after - before) / before))
+    return slower
+
+def report(results):
+    print("%-28s %9s %9s %9s %9s %9s %7s" % ('entry point', 'wall/s',
+          'total/s', 'sleep/s', 'io/s', 'compute/s', 'trans'))
+    for (name, r) in sorted(results['results'].items()):
+        print("%-28s %9.3f %9.3f %9.3f %9.3f %9.4f %7.1f" % (name,
+              r['wall'], r['total'], r['sleep'], r['io'], r['compute'],
+              r['transactions']))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*',
+                        help='entry points to run (default: all)')
+    parser.add_argument('-n', '--iterations', type=int, default=3)
+    parser.add_argument('-r', '--rate', type=float, default=100.,
+                        help='speed of the simulation clock')
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    parser.add_argument('--compare', help='earlier JSON results to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slow-down reported as a regression')
+    args = parser.parse_args()
+    results = run(args.names or None, args.iterations, args.rate)
+    report(results)
+    if args.output:
+        fout = open(args.output, 'w')
+        json.dump(results, fout, indent=1, sort_keys=True)
+        fout.close()
+    if args.compare:
+        fin = open(args.compare)
+        slower = compare(json.load(fin), results, args.tolerance)
+        fin.close()
+        for (name, before, after, change) in slower:
+            print("REGRESSION %s: %.3f s -> %.3f s (%+.0f%%)" %
+                  (name, before, after, 100*change))
+        if slower:
+            sys.exit(1)
@@ -4,9 +4,146 @@ this experiment.
 """
 
 # needed for various connections and operations
-import serial, struct, gpib, numpy, re
+import serial, struct, gpib, numpy, re, time, threading, Queue, math
 import Silver.analysis as analysis
 
+# fixed-capacity array storage used as the backend of Storage
+class RingBuffer:
+    """
+    FIFO of equally-shaped records kept in one preallocated numpy
+    array. Adding a record is O(1) and never moves the stored history.
+    """
+    def __init__(self, capacity=0, dtype=float):
+        """
+        capacity: number of records kept; the oldest record is
+                  overwritten once it is reached. If 0, the buffer
+                  keeps everything and grows by doubling.
+        dtype: numpy data type of the stored records. default: float
+        """
+        self.capacity = capacity
+        self.dtype = dtype
+        self.clear()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """
+        returns the index-th record, counting from the oldest one;
+        negative indices count from the newest.
+        """
+        if index < 0:
+            index += self.count
+        if not (0 <= index < self.count):
+            raise IndexError, "RingBuffer index out of range"
+        return self.buf[(self.start + index) % len(self.buf)]
+
+    def append(self, record):
+        """
+        stores a copy of record, evicting the oldest one if full.
+        """
+        record = numpy.asarray(record, dtype=self.dtype)
+        # the first record determines the shape of the buffer
+        if self.buf is None:
+            size = self.capacity
+            if size <= 0:
+                size = 16
+            self.buf = numpy.empty((size,) + record.shape, self.dtype)
+        assert record.shape == self.buf.shape[1:]
+
+        if self.count == len(self.buf):
+            if self.capacity > 0:
+                # full; overwrite the oldest record in place
+                self.buf[self.start] = record
+                self.start = (self.start + 1) % len(self.buf)
+                return
+            # unbounded; double the size (start is always 0 here)
+            tmp = numpy.empty((2*len(self.buf),) + self.buf.shape[1:],
+                              self.dtype)
+            tmp[:self.count] = self.buf
+            self.buf = tmp
+        self.buf[(self.start + self.count) % len(self.buf)] = record
+        self.count += 1
+
+    def isFull(self):
+        """
+        true if the next append will evict the oldest record.
+        """
+        return self.capacity > 0 and self.count == self.capacity
+
+    def take(self, indices):
+        """
+        returns an array of the records at indices (oldest first
+        numbering, as in __getitem__).
+        """
+        indices = numpy.asarray(indices, dtype=int)
+        return self.buf[(self.start + indices) % len(self.buf)]
+
+    def rows(self):
+        """
+        returns a view of all stored records, in no particular order;
+        cheap way to reduce over the whole history.
+        """
+        # stored records always occupy the first count slots
+        return self.buf[:self.count]
+
+    def clear(self):
+        """
+        forgets all records; the memory is reallocated on next append.
+        """
+        self.buf = None
+        self.start = 0
+        self.count = 0
+
+# streaming mean and variance, updated one record at a time
+class RunningStats:
+    """
+    per-element running mean and standard deviation (Welford's method),
+    supporting removal of records so that it can follow a FIFO.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self.avg = 0.
+        self.m2 = 0.
+
+    def add(self, record):
+        """
+        includes record in the statistics.
+        """
+        record = numpy.asarray(record, dtype=float)
+        self.n += 1
+        delta = record - self.avg
+        self.avg = self.avg + delta / self.n
+        self.m2 = self.m2 + delta * (record - self.avg)
+
+    def remove(self, record):
+        """
+        takes out record, which must have been added before.
+        """
+        record = numpy.asarray(record, dtype=float)
+        if self.n <= 1:
+            self.clear()
+            return
+        self.n -= 1
+        delta = record - self.avg
+        self.avg = self.avg - delta / self.n
+        # round-off can leave a tiny negative sum of squares
+        self.m2 = numpy.maximum(self.m2 - delta * (record - self.avg), 0.)
+
+    def mean(self):
+        return self.avg
+
+    def std(self):
+        """
+        population standard deviation, same as numpy.std
+        """
+        if self.n == 0:
+            return self.m2
+        return numpy.sqrt(self.m2 / self.n)
+
 # basic class for storage; specialized by two other classes
 class Storage:
     """
@@ -14,15 +151,20 @@ class Storage:
     for later averaging. In the context of the experiment, it really
     counts only as one.
     """
-    def __init__(self, maxStored=0):
+    def __init__(self, maxStored=0, streaming=False):
         """
         initializes the class; add initialization of self.data in
-        subclasses
+        subclasses (a list of RingBuffer, one per stored quantity)
         """
         # if maxStored = 0, the class will store all added data. If set
         # to a positive integer, the class keeps only up to maxStored
         # number of sets (in FIFO style).
         self.maxStored = maxStored
+        # in streaming mode, mean and std of the whole history are
+        # updated on every add, so that mean() costs the same no matter
+        # how many sets are stored. Subclasses define __running__().
+        self.streaming = streaming
+        self.stats = None
         
     def mean(self, indices = None):
         """
@@ -35,6 +177,8 @@ class Storage:
 
         # populate indices, if not given:
         if (indices == None):
+            if self.streaming:
+                return self.__running__()
             indices = range(len(self.data[0]))
         
         # __average__() need to be defined in child classes
@@ -46,15 +190,15 @@ class Storage:
         """
         adds an additional instance of the data.
         """
-        # check whether we have too much data and remove the excess
-        if self.maxStored > 0:
-            n = len(self.data[0]) - self.maxStored
-            if n >= 0:
-                for j in range(len(self.data)):
-                    tmp = self.data[j][n+1:]
-                    self.data[j] = tmp
-        # add the new data
+        if self.streaming and self.stats is None:
+            self.stats = [RunningStats() for j in range(len(self.data))]
+        # the ring buffers take care of dropping the excess; the
+        # statistics have to forget the evicted set first
         for j in range(len(self.data)):
+            if self.streaming:
+                if self.data[j].isFull():
+                    self.stats[j].remove(self.data[j][0])
+                self.stats[j].add(newdata[j])
             self.data[j].append(newdata[j])
     def num(self):
         return len(self.data[0])
@@ -64,37 +208,50 @@ class Storage:
         clears the stored values, usually done when the values
         have been saved to a more permanent storage.
         """
-        length = len(self.data)
-        self.data = [[] for j in range(length)]
+        for buf in self.data:
+            buf.clear()
+        self.stats = None
     
 # special class for storing plots
 class PlotStorage(Storage):
     """
     class object for storing plots
     """
-    def __init__(self,chs,*args):
-        apply(Storage.__init__,(self,) + args)
-        self.data = [[],[]]
+    def __init__(self,chs,*args,**kwargs):
+        apply(Storage.__init__,(self,) + args,kwargs)
+        # x is stored as (maxStored x samples), y as
+        # (maxStored x channels x samples); only channels in chs are kept
+        self.data = [RingBuffer(self.maxStored), RingBuffer(self.maxStored)]
         self.chs = chs
     def __average__(self,indices):
         """
         averages the vector quantities
         """
         # first, do a sanity check on the X parameters
-        for index in indices[1:]:
-            # this assertion expects data to be a numpy array
-            assert (self.data[0][0] == self.data[0][index]).all()
-        # first, build the matrix of quantities to be averaged over
-        tmp = [[] for j in range(4)]
-        for ch in self.chs:
-            for index in indices:
-                tmp[ch-1].append(self.data[1][index][ch-1])
+        x = self.data[0][0]
+        assert (self.data[0].take(indices[1:]) == x).all()
+        # the matrix of quantities to be averaged over:
+        # (indices x channels x samples)
+        tmp = self.data[1].take(indices)
         # compute the average of dependent quantities, as well as the
         # standard deviation
         Y = [[[],[]] for j in range(4)]
-        for ch in self.chs:
-            Y[ch-1][0] = numpy.mean(tmp[ch-1],0)
-            Y[ch-1][1] = numpy.std(tmp[ch-1],0)
+        for k, ch in enumerate(self.chs):
+            Y[ch-1][0] = numpy.mean(tmp[:,k],0)
+            Y[ch-1][1] = numpy.std(tmp[:,k],0)
+        return (x, Y)
+
+    def __running__(self):
+        """
+        average and standard deviation of all stored plots, from the
+        running statistics
+        """
+        Y = [[[],[]] for j in range(4)]
+        avg = self.stats[1].mean()
+        std = self.stats[1].std()
+        for k, ch in enumerate(self.chs):
+            Y[ch-1][0] = avg[k]
+            Y[ch-1][1] = std[k]
         return (self.data[0][0], Y)
     
     def add(self,x,y):
@@ -109,25 +266,37 @@ class PlotStorage(Storage):
         # dependent variables
         for ch in self.chs:
             assert len(x) == len(y[ch-1])
-        apply(Storage.add, (self,[x,y]))
+        # the running statistics cannot check the X parameters later
+        if self.streaming and self.num() > 0:
+            assert (self.data[0][0] == x).all()
+        apply(Storage.add, (self,[x,[y[ch-1] for ch in self.chs]]))
 
 # special class for storing T and dens
 class ParamStorage(Storage):
     """
     class object for storing parameters (T and dens)
     """
-    def __init__(self, *args):
-        apply(Storage.__init__,(self,)+args)
-        self.data = [[], []]
+    def __init__(self, *args, **kwargs):
+        apply(Storage.__init__,(self,)+args,kwargs)
+        self.data = [RingBuffer(self.maxStored), RingBuffer(self.maxStored)]
     def clearAll(self):
-        self.data = [[], []]
+        self.clear()
     def __average__(self,indices):
         """
         averages scalar quantities
         """
         # compute and return standard deviation, as well as the mean.
-        result = [[numpy.mean(self.data[0]), numpy.std(self.data[0])],
-                  [numpy.mean(self.data[1]), numpy.std(self.data[1])]]
+        T = self.data[0].rows()
+        dens = self.data[1].rows()
+        result = [[numpy.mean(T), numpy.std(T)],
+                  [numpy.mean(dens), numpy.std(dens)]]
+        return result
+    def __running__(self):
+        """
+        averages scalar quantities, from the running statistics
+        """
+        result = [[float(self.stats[0].mean()), float(self.stats[0].std())],
+                  [float(self.stats[1].mean()), float(self.stats[1].std())]]
         return result
 
 # minimally history-aware implementation.
@@ -139,7 +308,7 @@ class Scope(serial.Serial):
     GDS and Tektronics commands implemented into purpose-driven functions.
     """
     def __init__(self, port='/dev/ttyUSB1', baudrate=19200,
-                 model='TDS', chs=(1,2,3)):
+                 model='TDS', chs=(1,2,3), preamble='key', preambleAge=60.):
         """
         makes the serial connection, but no checking is done.
         chs: a tuple of channels. default: (1,2,3)
@@ -147,10 +316,41 @@ class Scope(serial.Serial):
         model: specifies set of commands. TDS or GDS. default: TDS
         baudrate: same rate as the device is set at (matters only for TDS).
                   default: 19200, the fastest for TDS.
+        preamble: when to re-read the calibration factors (calibV and
+                  calibH) in readWaveform. 'always': every time;
+                  'key': when the scale/position settings returned by
+                  one compound query change; 'never': only after
+                  invalidatePreamble() or when preambleAge runs out.
+                  default: key
+        preambleAge: seconds after which the calibration factors are
+                     re-read regardless; 0 disables. default: 60
         """
         serial.Serial.__init__(self, port=port, baudrate=baudrate)
         self.model = model
         self.chs = chs
+        # raw transfer buffer, reused (and grown if needed) by readData
+        self.__raw__ = bytearray(2500)
+        # calibrated per-channel arrays handed out by readWaveform when
+        # asked to reuse them
+        self.__volts__ = {}
+        # cached calibration factors; see checkPreamble
+        self.preamble = preamble
+        self.preambleAge = preambleAge
+        self.__key__ = None
+        self.invalidatePreamble()
+        # transfer window; see setWindow
+        self.start = 1
+        self.stop = 2500
+        self.width = 1
+        self.decimate = 1
+        # waveform blocks are read and calibrated chunkSize bytes at a
+        # time; if set, onChunk(ch, data) is called with the part of
+        # the calibrated record received so far (e.g. for live display)
+        self.chunkSize = 4096
+        self.onChunk = None
+        # GDS sends the sampling period and record length with the data
+        self.__gdsStep__ = None
+        self.__gdsPoints__ = None
         self.seq = self.readSeq()
         # it should never take more than 5 seconds for any I/O
         self.setTimeout(5)
@@ -190,40 +390,99 @@ class Scope(serial.Serial):
         else:
             return False
         
-    def readWaveform(self):
+    def readWaveform(self, reuse=False):
         """
         reads waveform,
         outputs calibrated time and data in a tuple
+        reuse: if True, the data arrays are kept by the scope and
+               overwritten on the next call with reuse=True (saves
+               the allocation; copy them if they need to be kept).
         """
         # prepare data holder
         y = [ 0 for j in range(4) ]
         # in case of previous errors
         self.flushInput()
+        # decide whether the cached calibration factors are still good
+        self.checkPreamble()
         for ch in self.chs:
             # mostly for TDS
             self.setCh(ch)
             # calibration factor we will need soon
-            (vmult, voff) = self.calibV()
-            # read and calibrate data
-            data = (numpy.array(self.readData()) - voff) * vmult
-            # This is from the formula in TDS manual, without the
-            # "vzero" in it---I couldn't figure out when that wouldn't
-            # be exactly zero.
-            y[ch-1]=data[:]
-
-        (hstep, hoff) = self.calibH()
-        # initialize time array
-        t = numpy.array(range(len(y[0])))
-        t = (t * hstep) + hoff
+            if ch not in self.__vcal__:
+                self.__vcal__[ch] = self.calibV(ch)
+            (vmult, voff) = self.__vcal__[ch]
+            # read and calibrate data, chunk by chunk as it arrives
+            out = None
+            if reuse:
+                out = self.__volts__.get(ch)
+            data = self.readData(ch, (vmult, voff, out))
+            if reuse:
+                self.__volts__[ch] = data
+            y[ch-1]=data[::self.decimate]
+
+        if self.__hcal__ is None:
+            self.__hcal__ = self.calibH()
+        (hstep, hoff) = self.__hcal__
+        # initialize time array; for TDS, hoff is the time of the first
+        # point of the record, not of the window
+        first = 0
+        if (self.model == 'TDS'):
+            first = self.start - 1
+        t = numpy.arange(len(y[self.chs[0]-1]), dtype=float)
+        t *= self.decimate * hstep
+        t += hoff + first * hstep
 
         # update the sequence number (... for isUpdated())
         self.seq = self.readSeq()
 
         return (t, y)
     
-    def calibV(self):
+    def invalidatePreamble(self):
+        """
+        forget the cached calibration factors; the next readWaveform
+        reads them from the scope again. Call after changing scales or
+        positions if preamble is not 'always' or 'key'.
+        """
+        self.__vcal__ = {}
+        self.__hcal__ = None
+        self.__calTime__ = time.time()
+
+    def preambleKey(self):
+        """
+        one round-trip query of the settings that the calibration
+        factors depend on (horizontal and vertical scale and position);
+        returns the raw answer, or None if not implemented for model.
+        """
+        if (self.model == 'TDS'):
+            self.flushInput()
+            query = 'HORizontal:MAIn:SCAle?;POSition?'
+            for ch in self.chs:
+                query += ';:CH'+str(ch)+':SCAle?;POSition?'
+            self.write(query+'\n')
+            return self.readline()
+        return None
+
+    def checkPreamble(self):
+        """
+        invalidate the cached calibration factors if they may be stale,
+        according to the preamble and preambleAge settings
+        """
+        if (self.preamble == 'always'):
+            self.invalidatePreamble()
+            return
+        if (self.preambleAge > 0) and \
+               (time.time() - self.__calTime__ > self.preambleAge):
+            self.invalidatePreamble()
+        if (self.preamble == 'key'):
+            key = self.preambleKey()
+            if (key is None) or (key != self.__key__):
+                self.invalidatePreamble()
+            self.__key__ = key
+
+    def calibV(self, ch=None):
         """
         return calibration factors for vertical scale
+        ch: channel; needed for GDS only (TDS uses the one set by setCh)
         """
         # clear buffer in case of errors
         self.flushInput()
@@ -256,10 +515,17 @@ class Scope(serial.Serial):
         self.flushInput()
         if (self.model == 'GDS'):
             # GDS includes the sampling rate data with the waveform
-            # data. hstep obtained later.
+            # data; hstep is the one from the last readData.
+            if self.__gdsStep__ is None:
+                raise Exception, "GDS sampling period not known before readData"
+            hstep = self.__gdsStep__
             self.write(':TIM:DEL?\n')
             # minus sign necessary to make hoff on two scopes congruous
             hoff = -float(self.readline())
+            # also, fix hoff so it corresponds with that for TDS (the
+            # delay is at the center of the record)
+            # FIXME: check with the scope at some point.
+            hoff = hoff - float(self.__gdsPoints__/2) * hstep
         elif (self.model == 'TDS'):
             self.write('WFMPre:XZEro?\n')
             hoff = float(self.readline())
@@ -269,6 +535,28 @@ class Scope(serial.Serial):
         self.flushInput()
         return (hstep, hoff)
         
+    def setWindow(self, start=1, stop=2500, width=1, decimate=1):
+        """
+        select the part of the record to transfer (TDS only).
+        start, stop: first and last point, counting from 1. The TDS
+                     record is 2500 points long.
+        width: bytes per point, 1 or 2 (2 gives finer vertical
+               resolution when the scope is averaging, at twice the
+               transfer time).
+        decimate: keep every decimate-th point of the transferred data.
+                  The TDS cannot decimate before sending, so this only
+                  saves memory and processing, not transfer time.
+        """
+        assert 1 <= start <= stop <= 2500
+        assert width in (1, 2)
+        assert decimate >= 1
+        self.start = start
+        self.stop = stop
+        self.width = width
+        self.decimate = decimate
+        # YMUlt/YOFf depend on the width
+        self.invalidatePreamble()
+
     def setCh(self, ch):
         """
         set channel for TDS, and ensure a bunch of options/modes for TDS
@@ -279,12 +567,64 @@ class Scope(serial.Serial):
             # according to the manual, RIBanary mode with 2-bit width is
             # the fastest mode for data transfer.
             # but I have to think 1-bit transfer ought to be faster.
-            self.write('DATa:SOUrce CH'+str(ch)+
-                       '; ENCdg RIBinary; STARt 1; STOP 2500; WIDth 1\n')
+            self.write('DATa:SOUrce CH'+str(ch)+'; ENCdg RIBinary'+
+                       '; STARt '+str(self.start)+'; STOP '+str(self.stop)+
+                       '; WIDth '+str(self.width)+'\n')
             # obtain vertical scale and offset (for calibration)
-    def readData(self):
+    def readBlock(self, size, dtype='i1', calib=None, ch=None):
+        """
+        read exactly size bytes into the reused transfer buffer,
+        chunkSize bytes at a time (the timeout applies to each chunk,
+        so long records do not time out).
+        Without calib, returns the data as a numpy array of dtype (a
+        view of the buffer, no copy is made).
+        calib: (vmult, voff, out); each chunk is calibrated into the
+               float array out as soon as it arrives, and out is
+               returned. out is allocated if None or the wrong size.
+        ch: channel passed on to onChunk.
+        """
+        dtype = numpy.dtype(dtype)
+        npts = size/dtype.itemsize
+        if len(self.__raw__) < size:
+            self.__raw__ = bytearray(size)
+        view = memoryview(self.__raw__)[:size]
+        if calib is not None:
+            (vmult, voff, out) = calib
+            if (out is None) or (len(out) != npts):
+                out = numpy.empty(npts)
+        got = 0
+        done = 0
+        while got < size:
+            n = self.readinto(view[got:min(size, got+self.chunkSize)])
+            if not n:
+                raise Exception, "Timed out reading waveform data"
+            got += n
+            if calib is None:
+                continue
+            # calibrate the points completed by this chunk. This is from
+            # the formula in TDS manual, without the "vzero" in it---I
+            # couldn't figure out when that wouldn't be exactly zero.
+            ready = got/dtype.itemsize
+            if ready > done:
+                raw = numpy.frombuffer(self.__raw__, dtype, ready-done,
+                                       done*dtype.itemsize)
+                numpy.subtract(raw, voff, out[done:ready])
+                out[done:ready] *= vmult
+                done = ready
+                if self.onChunk is not None:
+                    self.onChunk(ch, out[:done])
+        if calib is not None:
+            return out
+        return numpy.frombuffer(self.__raw__, dtype, npts)
+
+    def readData(self, ch=None, calib=None):
         """
         acquire waveform data; not calibrated
+        returns a numpy array that is a view of the transfer buffer,
+        valid only until the next read.
+        ch: channel; needed for GDS only (TDS uses the one set by setCh)
+        calib: (vmult, voff, out) to get calibrated data instead; see
+               readBlock
         """
         if (self.model == 'GDS'):
             self.write(':ACQ'+str(ch)+':MEM?\n')
@@ -302,25 +642,22 @@ class Scope(serial.Serial):
         if (self.model == 'GDS'):
             # subtract the 8 bytes we will read.
             dataSize -= 8
-            # Read the sampling period
-            hstep = struct.unpack('>f', self.read(4))[0]
-            # also, fix hoff so it corresponds with that for TDS
-            # FIXME: check with the scope at some point.
-            hoff = hoff - float(dataSize/4) * hstep
+            # Read the sampling period (used by calibH)
+            self.__gdsStep__ = struct.unpack('>f', self.read(4))[0]
+            self.__gdsPoints__ = dataSize/2
             # Read 4 bytes to advance to the actual data: first byte
             # contains the channel and the three are not used,
             # according to the GDS800 manual.
             self.read(4)
         
-        # Read data; TDS expects a 1-byte data, GDS expects 2-byte one.
+        # Read data; TDS sends the width set by setWindow, GDS sends
+        # 2-byte data. Both are signed and big-endian.
         if (self.model == 'TDS'):
-            data = list(struct.unpack('>'+str(dataSize)+'b',
-                                      self.read(dataSize)))
+            data = self.readBlock(dataSize, '>i'+str(self.width), calib, ch)
             # TDS has a trailing '\n' that should be drained.
             self.read(1)
         elif (self.model == 'GDS'):
-            data = list(struct.unpack('>'+str(dataSize/2)+'h',
-                                      self.read(dataSize)))
+            data = self.readBlock(dataSize, '>i2', calib, ch)
 
         return data
 
@@ -356,6 +693,216 @@ class Scope(serial.Serial):
             # testing, re: whether GDS returns the actual average
             # number, or log-base-2 of the average number.
 
+# computer-assisted averaging on top of the minimal Scope class.
+class ScopeAvg(Scope):
+    """
+    Scope that averages triggered waveforms in the computer (keeping the
+    running average and standard deviation in a PlotStorage), and can
+    estimate whether that or the scope's own averaging is faster.
+    """
+    def __init__(self, *args, **kwargs):
+        """
+        takes the arguments of Scope, plus (by keyword only):
+        maxStored: as in Storage; 0 averages everything since clear().
+                   default: 0
+        poll: seconds to wait between sequence number checks in acquire
+              when nothing new came in. default: 0.01
+        """
+        maxStored = kwargs.pop('maxStored', 0)
+        self.poll = kwargs.pop('poll', 0.01)
+        apply(Scope.__init__, (self,)+args, kwargs)
+        self.storage = PlotStorage(self.chs, maxStored, streaming=True)
+        # measured by acquire() and throughput()
+        self.rate = None
+        self.trigRate = None
+        self.transferTime = None
+
+    def acquire(self, n, timeout=None):
+        """
+        add n new triggered waveforms to the average, skipping any
+        waveform whose sequence number has not changed since the last
+        read. Gives up after timeout seconds if given.
+        returns the average, as PlotStorage.mean()
+        """
+        start = time.time()
+        j = 0
+        while j < n:
+            if (timeout is not None) and (time.time() - start > timeout):
+                raise Exception, "Scope did not trigger in time"
+            if self.isUpdated():
+                (t, y) = self.readWaveform(reuse=True)
+                self.storage.add(t, y)
+                j += 1
+            elif self.poll > 0:
+                time.sleep(self.poll)
+        self.rate = n / (time.time() - start)
+        return self.storage.mean()
+
+    def mean(self):
+        """
+        average and standard deviation of the waveforms acquired so far
+        """
+        return self.storage.mean()
+
+    def clear(self):
+        self.storage.clear()
+
+    def throughput(self, seconds=5.):
+        """
+        measure the trigger rate (over seconds) and the time one
+        readWaveform takes; returns (triggers/s, seconds/transfer)
+        """
+        seq = self.readSeq()
+        start = time.time()
+        time.sleep(seconds)
+        self.trigRate = (self.readSeq() - seq) / (time.time() - start)
+        start = time.time()
+        self.readWaveform(reuse=True)
+        self.transferTime = time.time() - start
+        return (self.trigRate, self.transferTime)
+
+    def compare(self, noise, seconds=5.):
+        """
+        estimate how long it takes to bring the standard deviation of
+        the averaged waveform down to noise (volts), by averaging in the
+        computer and by the scope's own averaging of readAvg() shots
+        per transfer. The single-shot noise is taken from the waveforms
+        acquired so far (needs at least 2).
+        returns (faster route 'computer' or 'scope', seconds by computer,
+                 seconds by scope)
+        """
+        assert self.storage.num() > 1
+        (t, Y) = self.storage.mean()
+        sigma = numpy.mean([numpy.mean(Y[ch-1][1]) for ch in self.chs])
+        # number of shots needed, from noise ~ sigma/sqrt(n)
+        n = math.ceil((sigma / noise)**2)
+
+        if self.trigRate is None:
+            self.throughput(seconds)
+        if self.trigRate <= 0:
+            raise Exception, "Scope is not triggering"
+        # computer averaging: one transfer per shot, at best one per
+        # trigger; use the rate acquire() actually achieved if known
+        if self.rate is not None:
+            tComputer = n / self.rate
+        else:
+            tComputer = n * max(self.transferTime, 1. / self.trigRate)
+        # scope averaging: navg triggers per transfer, and the averages
+        # of several transfers are averaged again in the computer
+        navg = self.readAvg()
+        if navg is None:
+            raise Exception, "readAvg not implemented for " + self.model
+        tScope = math.ceil(n / navg) * (navg / self.trigRate +
+                                        self.transferTime)
+        if tComputer < tScope:
+            return ('computer', tComputer, tScope)
+        return ('scope', tComputer, tScope)
+
+# continuous acquisition, so that analysis does not hold up the scope.
+class ScopeAcquirer(threading.Thread):
+    """
+    thread that watches the acquisition sequence number of a Scope and
+    reads every new waveform into a bounded queue of
+    (timestamp, seq, t, y) records.
+    """
+    def __init__(self, scope, maxQueued=100, policy='drop', poll=0.):
+        """
+        scope: a Scope object; nothing else should talk to it while the
+               thread is running.
+        maxQueued: size of the queue. default: 100
+        policy: what to do when the queue is full. 'drop' throws away
+                the oldest record; 'block' waits for the consumer (the
+                scope keeps triggering, so this shows up as missed).
+                default: drop
+        poll: seconds to wait between sequence number checks when
+              nothing new came in. default: 0
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scope = scope
+        self.queue = Queue.Queue(maxQueued)
+        assert policy in ('drop', 'block')
+        self.policy = policy
+        self.poll = poll
+        # counters: waveforms read, waveforms that triggered but were
+        # never read, records thrown away from a full queue, and I/O
+        # errors
+        self.acquired = 0
+        self.missed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.running = False
+
+    def run(self):
+        """
+        poll the scope until stop() is called
+        """
+        self.running = True
+        last = self.scope.readSeq()
+        while self.running:
+            try:
+                seq = self.scope.readSeq()
+                if seq == last:
+                    if self.poll > 0:
+                        time.sleep(self.poll)
+                    continue
+                # more than one step means triggers we never read out
+                if seq - last > 1:
+                    self.missed += seq - last - 1
+                last = seq
+                (t, y) = self.scope.readWaveform()
+                self.acquired += 1
+                self.put((time.time(), seq, t, y))
+            except Exception, e:
+                self.errors += 1
+                print("scope acquisition failed (%s), trying to continue" % e)
+                # the port itself may be what failed; keep the thread
+                # alive and do not spin on it
+                try:
+                    self.scope.flushInput()
+                except Exception:
+                    time.sleep(max(self.poll, 0.1))
+
+    def put(self, record):
+        """
+        queue a record according to the policy
+        """
+        if self.policy == 'block':
+            # wake up now and then to notice stop()
+            while self.running:
+                try:
+                    self.queue.put(record, True, 0.5)
+                    return
+                except Queue.Full:
+                    pass
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except Queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except Queue.Empty:
+                        pass
+
+    def get(self, timeout=None):
+        """
+        returns the next (timestamp, seq, t, y) record; waits up to
+        timeout seconds (forever if None) and raises Queue.Empty if
+        nothing came.
+        """
+        return self.queue.get(True, timeout)
+
+    def stop(self):
+        """
+        stop acquiring; returns once the thread is done with the scope
+        """
+        self.running = False
+        if self.isAlive():
+            self.join()
+
 # A class more or less operates independently (but be careful not to
 # probe the device LakeShore thermometer is connected to, especially
 # after it has been initialized).
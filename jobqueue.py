@@ -0,0 +1,96 @@
+"""
+a thread that owns an instrument and does the jobs queued for it, one
+at a time, in order; callers get a Future for each job and wait on it.
+Used by oven.TCWorker (USB-2001-TC transfers) and lockintools.Worker
+(lock-in functions).
+
+    class Printer(jobqueue.QueueWorker):
+        def do(self,text):
+            return len(text)
+    p=Printer()
+    p.start()
+    n=p.put('hello').result(10)
+"""
+import sys, threading, Queue
+import ticker
+
+class Future:
+    """
+    result of a job queued on a QueueWorker
+    """
+    def __init__(self):
+        self.condition=threading.Condition()
+        self.finished=False
+        self.value=None
+        self.error=None
+    def set(self,value=None,error=None):
+        """
+        error: sys.exc_info() of the exception raised, if any
+        """
+        self.condition.acquire()
+        try:
+            self.value=value
+            self.error=error
+            self.finished=True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+    def result(self,timeout=None):
+        """
+        wait for the job to complete and return its result; raises the
+        exception the job raised, if any
+        """
+        # see ticker: exact wake-up, and Ctrl-C still gets through
+        self.condition.acquire()
+        try:
+            if not ticker.wait(self.condition,lambda: self.finished,timeout):
+                raise Exception, "job timed out"
+        finally:
+            self.condition.release()
+        if self.error is not None:
+            # with the traceback from the worker thread
+            raise self.error[0],self.error[1],self.error[2]
+        return self.value
+
+class QueueWorker(threading.Thread):
+    """
+    daemon thread doing the jobs put on its queue; subclasses define
+    do(*args), which runs in the thread for each job
+    """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon=True
+        self.queue=Queue.Queue()
+    def put(self,*args,**kw):
+        """
+        queue do(*args); returns its Future (or future, if given)
+        """
+        future=kw.get('future')
+        if future is None:
+            future=Future()
+        self.queue.put((future,args))
+        return future
+    def stop(self):
+        """
+        end the thread once the jobs already queued are done
+        """
+        self.queue.put(None)
+    def do(self,*args):
+        raise NotImplementedError
+    def failed(self):
+        """
+        called in the thread after a job raised, once its caller has the
+        error
+        """
+        pass
+    def run(self):
+        while True:
+            item=self.queue.get()
+            if item is None:
+                return
+            (future,args)=item
+            try:
+                future.set(self.do(*args))
+            except Exception:
+                future.set(error=sys.exc_info())
+                self.failed()
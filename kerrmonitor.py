@@ -1,6 +1,8 @@
 import time
 import os
-from numpy import arcsin,cos,sqrt,pi
+import logwriter
+import lockintools
+import polarimetry
 
 from visa import *
 
@@ -8,6 +10,9 @@ lockin = instrument("GPIB::12")
 #lockin2 is the borrowed lockinamplifier
 lockin.timeout = 10
 dmm  = instrument("GPIB::23")
+log = logwriter.shared()
+#reference phase found for each harmonic, restored on every switch
+phases = lockintools.PhaseManager()
 
 def lockin1info():
     "Gives the current values displayed on screen, as well as the X and Y magnitudes."
@@ -40,76 +45,27 @@ def polarization(outfile=None):
     """
 
     (z,)= dmm.ask_for_values("*IDN?")
-    (u,)= lockin.ask_for_values("TC.")
-#1st harmonic on fist lockin
-    lockin.write("REFN 1")
-    lockin.write("AQN")
-    time.sleep(u)#wait before measuring
-    (x,y)= lockin.ask_for_values("XY.")
+#1st harmonic on fist lockin; the phase from last time is restored, and
+#auto-phasing only done if y is no longer < 1% of x
+    (t,x,y,mag)= lockintools.measure(lockin, 1, phases=phases)
 #    print "(x,y)=(%g,%g)" % (x,y)
-    i=0
-#    print u
-    #checking condition
-    while abs(y) > (abs(x) * 0.01):
-        lockin.write("AQN")
-        time.sleep(u);
-        (x,y)= lockin.ask_for_values("XY.")
-        i+=1; 
-#        print "(x,y)=(%g,%g)" % (x,y)
-        if i > 10:
-#            print "Warning: phase may be incorrect."
-            (m,)= (lockin.ask_for_values("MAG."))
-            mag = m*abs(x)/(x)
-#            print "Magnitude of 1st Harmonic = (%g)" % (m)
-            break
-        else:
-            (m,)= (lockin.ask_for_values("MAG."))
-            mag = m*abs(x)/(x)
-    time.sleep(u*100) #wait to switch between harmonics.
-
 
 #2nd harmonic on first lockin
-    lockin.write("REFN 2")
-    time.sleep(u) #wait to switch between harmonics.    
-    lockin.write("AQN")
-    (v,w)= lockin.ask_for_values("XY.")
+    (s,v,w,nag)= lockintools.measure(lockin, 2, phases=phases)
     v1 = v*0.8472
 #    print "(v,w)=(%g,%g)" % (v,w)
-    i=0
-    while abs(w) > (abs(v) * 0.01):
-        lockin.write("AQN")
-        time.sleep(u);
-#        print "(v,w)=(%g,%g)" % (v,w)
-        i+=1;
-        if i > 10:
-#            print "Warning: phase may be incorrect."
-            (n,) = lockin.ask_for_values("MAG.")
-            nag = (n*abs(v)/(v))*0.8475
-            #0.8472 is conversion factor to account for gain piqueing
-#            print "Magnitude of 2st Harmonic on fist lockin= (%g)" % (n)
-            break
-        else:
-            (n,) = lockin.ask_for_values("MAG.")
-            nag = (n*abs(v)/(v))*0.8475
+    if nag is not None:
+        nag = nag*0.8475
+        #0.8472 is conversion factor to account for gain piqueing
 
         
 #    print "DC voltage 1 is ", (z)
 #    print "DC voltage 2 is ", (d)
-    if abs(y) < (abs(x) * 0.01):
-        e1 = 0.5*arcsin((abs(x))/(abs(z)*(0.519147*sqrt(2))))
-    else:
-        e1 = 0.5*arcsin((abs(mag)/abs(z))/(0.519147*sqrt(2)))
-#        print "Magnitude used to calculate the following"
-#l = abs((nag)/(cos(2. * e1)*z*(0.431755*sqrt(2))))
-
-#    if l < 1.0:
-    if abs(w) < (abs(v) * 0.01):
-        b1 = 0.5*arcsin((v1)/(cos(2. * e1)*z*(0.431755*sqrt(2))))
-    else:
-        b1 = 0.5*arcsin((nag)/(cos(2. * e1)*z*(0.431755*sqrt(2))))
-#    else:
-#        b1 = .785398
-#        print "magnitude used to calculate"
+#the magnitude (with the sign of x) is used where measure returned one
+    if nag is None:
+        nag = v1
+    (e1,b1,ok1,ok2) = polarimetry.polarization(abs(polarimetry.amplitude(x, mag)), nag, z)
+    (e1,b1) = (float(e1),float(b1))
     
     #(azi,) = pi/4.
     #lockin.write("REFN 1")
@@ -119,15 +75,9 @@ def polarization(outfile=None):
     os.chdir("C:\lockindata")
     #sets directory
     if outfile is not None:
-        try:
-            #write out the values to a txt file
-            fout = open("%s.txt" % (tester), 'a')
-            fout.write('%s\n ' % (ellip))
-            fout.close()
-        except:
-            print("FILE OUTPUT FAILED, trying to continue")
-    lockin.write("REFN 1")   
-    lockin.write("AQN")
+        #queue the values for the txt file (written by the log thread)
+        log.write("%s.txt" % (tester), '%s\n ' % (ellip))
+    phases.restore(lockin, 1)
     print "(ellipticity, azimuth) = (%g,%g)" % (e1, b1)
 #    print "(ellipticity1, ellipticity2, azimuth1, azimuth2)"
 #    return (e1, e2, b1, b2)1
@@ -155,51 +105,21 @@ Will only measure ellipticity. HIgh auto rephase rate
 """
     
     (z,)= dmm.ask_for_values("*IDN?")
-    (u,)= lockin.ask_for_values("TC.")
-#1st harmonic on fist lockin
-    lockin.write("REFN 1")
-    lockin.write("AQN")
-    time.sleep(u)#wait before measuring
-    (x,y)= lockin.ask_for_values("XY.")
+#1st harmonic on fist lockin, from the stored phase (see polarization)
+    (t,x,y,mag)= lockintools.measure(lockin, 1, phases=phases)
 #    print "(x,y)=(%g,%g)" % (x,y)
-    i=0
-#    print u
-    #checking condition
-    while abs(y) > (abs(x) * 0.01):
-        lockin.write("AQN")
-        time.sleep(u);
-        (x,y)= lockin.ask_for_values("XY.")
-        i+=1; 
-#        print "(x,y)=(%g,%g)" % (x,y)
-        if i > 10:
-#            print "Warning: phase may be incorrect."
-            (m,)= (lockin.ask_for_values("MAG."))
-            mag = m*abs(x)/(x)
-#            print "Magnitude of 1st Harmonic = (%g)" % (m)
-            break
-    time.sleep(u*100) #wait to switch between harmonics.
-
-    if abs(y) < (abs(x) * 0.01):
-        e1 = 0.5*arcsin((abs(x))/(abs(z)*(0.519147*sqrt(2))))
-    else:
-        e1 = 0.5*arcsin((abs(mag)/abs(z))/(0.519147*sqrt(2)))
-#        print "Magnitude used to calculate the following"
-#l = abs((nag)/(cos(2. * e1)*z*(0.431755*sqrt(2))))
+
+    (e1,ok1) = polarimetry.ellipticity(abs(polarimetry.amplitude(x, mag)), z)
+    e1 = float(e1)
 
     tester=outfile
     ellip = str(e1)
     os.chdir("C:\lockindata")
     #sets directory
     if outfile is not None:
-        try:
-            #write out the values to a txt file
-            fout = open("%s.txt" % (tester), 'a')
-            fout.write('%s\n ' % (ellip))
-            fout.close()
-        except:
-            print("FILE OUTPUT FAILED, trying to continue")
-    lockin.write("REFN 1")   
-    lockin.write("AQN")
+        #queue the values for the txt file (written by the log thread)
+        log.write("%s.txt" % (tester), '%s\n ' % (ellip))
+    phases.restore(lockin, 1)
     print "(ellipticity = %g)" % (e1)
 #    print "(ellipticity1, ellipticity2, azimuth1, azimuth2)"
 #    return (e1, e2, b1, b2)1
@@ -220,3 +140,26 @@ of the polarizer after the PEM.
         out=outfile
         ellipticity(out)    
         time.sleep(.5)
+
+def findkerrbuffered(outfile=None, n=1000, interval=0.005):
+    """
+Like findkerr, but the lockin stores n points of X and of the DC level
+(on its ADC1 input), one every interval sec, in its curve buffer; they
+are read out n at a time, so the ellipticity comes at the lockin's rate
+instead of one point per GPIB query.
+"""
+    phases.autophase(lockin, 1)
+    buf = lockintools.CurveBuffer(lockin, ('X','ADC1'), n, interval)
+    control = True
+    while control:
+        data = buf.acquire()
+        #same as ellipticity, on all the points at once
+        (e1,ok1) = polarimetry.ellipticity(abs(data['X']), data['ADC1'])
+        os.chdir("C:\lockindata")
+        if outfile is not None:
+            #all the points in one go (written by the log thread)
+            log.write("%s.txt" % (outfile), "".join(['%s\n ' % (e) for e in e1]))
+        if ok1.any():
+            print "(ellipticity = %g, %d of %d points)" % (e1[ok1].mean(), ok1.sum(), len(e1))
+        else:
+            print "(ellipticity out of range in all %d points)" % (len(e1))
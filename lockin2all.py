@@ -1,6 +1,9 @@
 import time
 import os
-from numpy import arcsin,cos,sqrt,pi
+import logwriter
+import lockintools
+import polarimetry
+from numpy import hypot,sign
 
 from visa import *
 """
@@ -13,6 +16,18 @@ lockin2 = instrument("GPIB::13")
 #lockin2 is the borrowed lockinamplifier
 
 dmm  = instrument("GPIB::23")
+log = logwriter.shared()
+
+#dedicated-harmonic mode: lockin stays on 1f and lockin2 on 2f, both read
+#at once, so nothing is switched (or waited for) between readings
+worker = lockintools.Worker(lockin)
+worker2 = lockintools.Worker(lockin2)
+phases = lockintools.PhaseManager()
+barrier = lockintools.Barrier(2, timeout=10)
+#gain peaking of lockin on 2f (see kerrmonitor); lockin2's 2f gain is
+#calibrated against it by crosscalibrate
+PEAKING = 0.8472
+gain2 = None
 
 def lockin1info():
     "Gives the current values displayed on screen, as well as the X and Y magnitudes."
@@ -34,55 +49,40 @@ def harmonic(a):
     lockin.write("AQN")
     print  'Current harmonic is', a
     
-def getvalue(outfile=None):
+def getvalue(outfile=None, wait=10., accuracy=lockintools.ACCURACY, converge=False):
+    """
+Reads lockin2 on the 2nd harmonic, switches lockin to the 1st and reads lockin2
+again. wait: seconds for lockin2 to follow the switch; None waits until its
+outputs settle to accuracy instead (see lockintools.settle): 46 s (6 dB/oct)
+to 66 s (12 dB/oct) at its 10 s time constant for 1%; converge can end earlier.
+"""
     #lockin.write("REFN 2")
     (x2,y2) = lockin2.ask_for_values("XY.")
     (mag) = lockin2.ask_for_values("MAG.")
     os.chdir("C:\lockindata")
     tester = outfile
     if outfile is not None:
-        try:
-            #write out the values to a file
-            fout=open("%sr_2.txt" % (tester),'a')
-            fout.write('%s\n' % (mag))
-            fout.close()
-        except:
-            print("FILE OUTPUT FAILED, trying to continue")
-        try:
-            #write out the values to a file
-            fout=open("%sxy_2.txt" % (tester),'a')
-            fout.write('%s,%s\n' % (x2,y2))
-            fout.close()
-        except:
-            print("FILE OUTPUT FAILED, trying to continue")
+        #queue the values for the files (written by the log thread)
+        log.write("%sr_2.txt" % (tester),'%s\n' % (mag))
+        log.write("%sxy_2.txt" % (tester),'%s,%s\n' % (x2,y2))
     print("Harmonic 2 Magnitude: %s" % (mag))
 #now switch to first harmonic
     lockin.write("REFN 1")
-    time.sleep(10)
+    #wait for the second lockin to follow the new harmonic
+    lockintools.pause(lockin2, wait, accuracy=accuracy, converge=converge)
     (x2,y2) = lockin2.ask_for_values("XY.")
     (mag) = lockin2.ask_for_values("MAG.")
     os.chdir("C:\lockindata")
     tester = outfile
     if outfile is not None:
-        try:
-            #write out the values to a file
-            fout=open("%sr_1.txt" % (tester),'a')
-            fout.write('%s\n' % (mag))
-            fout.close()
-        except:
-            print("FILE OUTPUT FAILED, trying to continue")
-        try:
-            #write out the values to a file
-            fout=open("%sxy_1.txt" % (tester),'a')
-            fout.write('%s,%s\n' % (x2,y2))
-            fout.close()
-        except:
-            print("FILE OUTPUT FAILED, trying to continue")
+        #queue the values for the files (written by the log thread)
+        log.write("%sr_1.txt" % (tester),'%s\n' % (mag))
+        log.write("%sxy_1.txt" % (tester),'%s,%s\n' % (x2,y2))
     print("Harmonic 1 Magnitude: %s" % (mag))
     lockin.write("REFN 2")
           
 
-def getvalues(outfile=None, sec = .5):
+def getvalues(outfile=None, sec = .5, wait=10.):
     """
 Repeats the get value scheme to get the diff. every second.
 """
@@ -90,5 +90,115 @@ Repeats the get value scheme to get the diff. every second.
     control = True
     while control:
         out=outfile
-        getvalue(out)    
+        getvalue(out, wait)    
+        time.sleep(sec)
+
+def readxy(lock):
+    "Reads X and Y at the same time as the other lockin; returns (time, x, y)."
+    barrier.wait()
+    t = time.time()
+    (x,y) = lock.ask_for_values("XY.")
+    return (t,x,y)
+
+def setharmonics():
+    "Puts lockin on the 1st and lockin2 on the 2nd harmonic, both phased."
+    jobs = [worker.submit(phases.autophase, 1), worker2.submit(phases.autophase, 2)]
+    [job.result() for job in jobs]
+
+def crosscalibrate(n=10):
+    """
+Puts both lockins on the 2nd harmonic and compares their magnitudes,
+read at the same time, n times; lockin2's 2f readings are scaled by
+gain2 to match lockin's (corrected by PEAKING). Leaves the lockins on
+1f and 2f. Returns gain2.
+"""
+    global gain2
+    jobs = [wk.submit(phases.autophase, 2) for wk in (worker, worker2)]
+    [job.result() for job in jobs]
+    u = lockintools.filters(lockin)[0]
+    ratio = 0.
+    for i in range(n):
+        jobs = [wk.submit(readxy) for wk in (worker, worker2)]
+        ((t,x,y),(s,v,w)) = [job.result() for job in jobs]
+        ratio += hypot(x,y)/hypot(v,w)
+        #independent readings
+        time.sleep(u)
+    gain2 = PEAKING*ratio/n
+    setharmonics()
+    return gain2
+
+def getpolarization(outfile=None):
+    """
+Reads both lockins at the same time, in dedicated-harmonic mode (see
+setharmonics and crosscalibrate), and calculates the ellipticity and
+azimuth. The magnitudes (with the sign of x) are used, so a small phase
+drift does not matter. Sets up the harmonics and calibrates first if not
+done yet. Returns (ellipticity, azimuth).
+"""
+    if gain2 is None:
+        crosscalibrate()
+    (z,) = dmm.ask_for_values("*IDN?")
+    jobs = [worker.submit(readxy), worker2.submit(readxy)]
+    ((t,x,y),(s,v,w)) = [job.result() for job in jobs]
+    mag = hypot(x,y)
+    nag = hypot(v,w)*sign(v)*gain2
+    (e1,b1,ok1,ok2) = polarimetry.polarization(mag, nag, z)
+    (e1,b1) = (float(e1),float(b1))
+    if outfile is not None:
+        #queue the values for the file (written by the log thread)
+        log.record("%spol.txt" % (outfile), (e1, b1), t)
+    print "(ellipticity, azimuth) = (%g,%g)" % (e1, b1)
+    return (e1, b1)
+
+def streampolarization(outfile=None, sec=None):
+    """
+Continuous stream of ellipticity and azimuth in dedicated-harmonic mode,
+one reading every sec (default: the longer time constant of the two
+lockins). Sets up the harmonics and calibrates first if not done yet
+(see getpolarization).
+"""
+    if sec is None:
+        sec = max(lockintools.filters(lockin)[0], lockintools.filters(lockin2)[0])
+    control = True
+    while control:
+        getpolarization(outfile)
         time.sleep(sec)
+
+def readbuffer(lock, buf):
+    "Arms buf (on lock), starts it at the same time as the other lockin, and returns its data (with the times of the points in 't')."
+    buf.arm()
+    barrier.wait()
+    buf.start()
+    data = buf.fetch(buf.wait())
+    data['t'] = data['t'] + buf.started
+    return data
+
+def getvaluesbuffered(outfile=None, n=1000, interval=0.005):
+    """
+Continuous stream of ellipticity and azimuth in dedicated-harmonic mode,
+through the curve buffers: both lockins store n points, one every interval
+sec, started together, and are read out n at a time. The DC level is taken
+from lockin's ADC1 input. Sets up the harmonics and calibrates first if not
+done yet.
+"""
+    if gain2 is None:
+        crosscalibrate()
+    buf = lockintools.CurveBuffer(lockin, ('X','Y','ADC1'), n, interval)
+    buf2 = lockintools.CurveBuffer(lockin2, ('X','Y'), n, interval)
+    control = True
+    while control:
+        jobs = [worker.submit(readbuffer, buf), worker2.submit(readbuffer, buf2)]
+        (data, data2) = [job.result() for job in jobs]
+        #same as getpolarization, on all the points at once
+        z = data['ADC1']
+        mag = hypot(data['X'],data['Y'])
+        nag = hypot(data2['X'],data2['Y'])*sign(data2['X'])*gain2
+        (e1,b1,ok1,ok2) = polarimetry.polarization(mag, nag, z)
+        if outfile is not None:
+            #all the points in one go (written by the log thread)
+            log.write("%spol.txt" % (outfile), "".join(["%.3f,%g,%g\n" % (t, e, b)
+                      for (t, e, b) in zip(data['t'], e1, b1)]))
+        if ok2.any():
+            print "(ellipticity, azimuth) = (%g,%g), %d of %d points" % (e1[ok2].mean(), b1[ok2].mean(), ok2.sum(), len(e1))
+        else:
+            print "(ellipticity, azimuth) out of range in all %d points" % (len(e1))
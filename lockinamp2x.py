@@ -1,13 +1,20 @@
 import time
-from numpy import arcsin,cos,sqrt,pi
+from numpy import array
 
 from visa import *
+import lockintools
+import polarimetry
 
 lockin = instrument("GPIB::12")
 lockin2 = instrument("GPIB::13")
 #lockin2 is the borrowed lockinamplifier
 
 dmm  = instrument("GPIB::23")
+#one worker thread per lockin, so both can be measured at once
+worker = lockintools.Worker(lockin)
+worker2 = lockintools.Worker(lockin2)
+#reference phases found for each lockin and harmonic, restored on every switch
+phases = lockintools.PhaseManager()
 
 def lockin1info():
     "Gives the current values displayed on screen, as well as the X and Y magnitudes."
@@ -30,124 +37,39 @@ def harmonic(a):
     print  'Current harmonic is', a
     
 
-def polarization(intensity):
+def polarization(intensity, accuracy=lockintools.ACCURACY, converge=False):
     """
     Measures both X, Y in both harmonics, and DC voltage,
     and calculates the ellipticity(radians) in the light.
     If conditions of y < 10% of x, magnitude is used to
     calculate ellipticity.
     Both ellipticity and azimuth are written to file.
+    accuracy, converge: of the settling after each switch (see
+    lockintools.settle); with lockin2's 10 s time constant that is
+    46 s (6 dB/oct) to 66 s (12 dB/oct) per harmonic at 1%.
     """
 
     d = float (intensity)
     (z,)= dmm.ask_for_values("*IDN?")
-    (u,)= lockin.ask_for_values("TC.")
-    (p,)= lockin2.ask_for_values("TC.")
-#1st harmonic on fist lockin
-    lockin.write("REFN 1")
-    lockin.write("AQN")
-    time.sleep(u)#wait before measuring
-    (x,y)= lockin.ask_for_values("XY.")
-#    print "(x,y)=(%g,%g)" % (x,y)
-    i=0
-#    print u
-    #checking condition
-    while abs(y) > (abs(x) * 0.01):
-        lockin.write("AQN")
-        time.sleep(u);
-        (x,y)= lockin.ask_for_values("XY.")
-        i+=1; 
-#        print "(x,y)=(%g,%g)" % (x,y)
-        if i > 10:
-#            print "Warning: phase may be incorrect."
-            (m,)= (lockin.ask_for_values("MAG."))
-            mag = m*abs(x)/(x)
-#            print "Magnitude of 1st Harmonic = (%g)" % (m)
-            break
-    #time.sleep(u*100) #wait to switch between harmonics.
-
-#1st harmonic on 2nd lockin
-    lockin2.write("REFN 1")
-    lockin2.write("AQN")
-    time.sleep(u)#wait before measuring
-    (x1,y1)= lockin2.ask_for_values("XY.")
-#    print "(x1,y1)=(%g,%g)" % (x1,y1)
-    i=0
-#    print u
-    #checking condition
-    while abs(y1) > (abs(x1) * 0.01):
-        lockin2.write("AQN")
-        time.sleep(u);
-        (x1,y1)= lockin2.ask_for_values("XY.")
-        i+=1; 
-#        print "(x1,y1)=(%g,%g)" % (x1,y1)
-        if i > 10:
-#            print "Warning: phase may be incorrect."
-            (k,)= (lockin2.ask_for_values("MAG."))
-            kag = k*abs(x1)/(x1)
-#            print "Magnitude of 1st Harmonic on Second lockin= (%g)" % (k)
-            break
-    
-#2nd harmonic on first lockin
-    lockin.write("REFN 2")
-    lockin.write("AQN")
-    time.sleep(u) #wait to switch between harmonics.    
-    (v,w)= lockin.ask_for_values("XY.")
-#    print "(v,w)=(%g,%g)" % (v,w)
-    i=0
-    while abs(w) > (abs(v) * 0.01):
-        lockin.write("AQN")
-        time.sleep(u);
-#        print "(v,w)=(%g,%g)" % (v,w)
-        i+=1;
-        if i > 10:
-#            print "Warning: phase may be incorrect."
-            (n,) = lockin.ask_for_values("MAG.")
-            nag = n*abs(v)/(v)
-#            print "Magnitude of 2st Harmonic on fist lockin= (%g)" % (n)
-            break
-#Now do 2nd harmonic on second lockin
-    lockin2.write("REFN 2")
-    lockin2.write("AQN")
-    time.sleep(u) #wait to switch between harmonics.    
-    (v1,w1)= lockin2.ask_for_values("XY.")
-#    print "(v1,w1)=(%g,%g)" % (v1,w1)
-    i=0
-    while abs(w1) > (abs(v1) * 0.01):
-        lockin2.write("AQN")
-        time.sleep(u);
-        (v1,w1)= lockin2.ask_for_values("XY.")
-#        print "(v1,w1)=(%g,%g)" % (v1,w1)
-        i+=1;
-        if i > 10:
-#            print "Warning: phase may be incorrect."
-            (c,) = lockin2.ask_for_values("MAG.")
-            cag = c*abs(v1)/(v1)
-#            print "Magnitude of 2st Harmonic on second lockin= (%g)" % (c)
-            break
+#both lockins are phased and read at the same time, one harmonic after
+#the other; the barrier lines up their readings. Each waits for its own
+#outputs to settle after every change.
+    settle = max(lockintools.settleTime(lockin, accuracy), lockintools.settleTime(lockin2, accuracy))
+    barrier = lockintools.Barrier(2, timeout=24*settle+10)
+#1st harmonic on both lockins
+    jobs = [wk.submit(lockintools.measure, 1, None, barrier, phases, accuracy, converge) for wk in (worker, worker2)]
+    ((t,x,y,mag),(t1,x1,y1,kag)) = [job.result() for job in jobs]
+#2nd harmonic on both lockins
+    jobs = [wk.submit(lockintools.measure, 2, None, barrier, phases, accuracy, converge) for wk in (worker, worker2)]
+    ((s,v,w,nag),(s1,v1,w1,cag)) = [job.result() for job in jobs]
     
 #    print "DC voltage 1 is ", (z)
 #    print "DC voltage 2 is ", (d)
-    if abs(y) < (abs(x) * 0.01):
-        e1 = 0.5*arcsin((abs(x)/abs(z))/(0.519147*sqrt(2)))
-    else:
-        e1 = 0.5*arcsin((abs(mag)/abs(z))/(0.519147*sqrt(2)))
-#        print "Magnitude used to calculate the following"
-    if abs(w) < (abs(v) * 0.01):
-        b1 = 0.5*arcsin((abs(v)*cos(2. * abs(e1)))/abs(z))/(0.431755*sqrt(2))
-    else:
-        b1 = 0.5*arcsin((abs(nag)*cos(2. * abs(e1)))/abs(z))/(0.431755*sqrt(2))
-#        print "magnitude used to calculate"
-    if abs(y1) < (abs(x1) * 0.01):
-        e2 = 0.5*arcsin((abs(x1)/abs(d))/(0.519147*sqrt(2)))
-    else:
-        e2 = 0.5*arcsin((abs(kag)/abs(d))/(0.519147*sqrt(2)))
-#        print "Magnitude used to calculate the following"
-    if abs(w1) < (abs(v1) * 0.01):
-        b2 = 0.5*arcsin((abs(v1)*cos(2. * abs(e2)))/abs(d))/(0.431755*sqrt(2))
-    else:
-        b2 = 0.5*arcsin((abs(cag)*cos(2. * abs(e2)))/abs(d))/(0.431755*sqrt(2))
-#        print "magnitude used to calculate"
+#magnitudes (with the sign of x) where measure returned them; all
+#amplitudes taken as positive
+    h1 = abs(polarimetry.amplitude([x, x1], [mag, kag]))
+    h2 = abs(polarimetry.amplitude([v, v1], [nag, cag]))
+    ((e1,e2),(b1,b2),ok1,ok2) = polarimetry.polarization(h1, h2, array([z, d]))
     diff = float(e2 - e1)
     #(azi,) = pi/4.
     #lockin.write("REFN 1")
@@ -0,0 +1,461 @@
+"""
+helpers for running the lock-in amplifiers (GPIB, through visa): a
+worker thread per instrument, so several lock-ins can be set up and
+read at the same time, and a barrier to line up their readings.
+
+    w1=Worker(lockin)
+    w2=Worker(lockin2)
+    barrier=Barrier(2)
+    jobs=[w.submit(measure,1,wait,barrier) for w in (w1,w2)]
+    ((t1,x1,y1,mag1),(t2,x2,y2,mag2))=[job.result() for job in jobs]
+
+After a change (harmonic, phase, ...) the outputs take a while to get
+to their new values; settle waits as long as the output filter needs
+for a given accuracy (1% by default), from the time constant and
+slope set on the lock-in (read once, see filters), or until successive
+readings agree.
+
+Auto-phasing (AQN) after every harmonic switch takes several settling
+times; a PhaseManager restores the phase found before instead, and
+only auto-phases when that no longer puts the signal in X.
+
+A CurveBuffer has the lock-in sample its outputs into its own memory at
+a fixed interval, and fetches them in one binary transfer per curve,
+instead of one XY. query per point.
+"""
+import time, threading, atexit, math
+import numpy
+import ticker, jobqueue
+
+# RC poles of the output filter for each SLOPE setting (6, 12, 18 and
+# 24 dB/octave)
+POLES={0:1,1:2,2:3,3:4}
+# default settling accuracy (fraction of the step); as good as the
+# auto-phasing tolerance, so waiting longer gains nothing
+ACCURACY=1e-2
+# (time constant, slope) read from each lock-in; see filters
+FILTERS={}
+FILTERSLOCK=threading.Lock()
+
+# result of a function queued on a Worker
+Job=jobqueue.Future
+
+class Worker(jobqueue.QueueWorker):
+    """
+    thread that owns one instrument and runs the functions queued for
+    it, one at a time, in order
+    """
+    def __init__(self,instrument):
+        jobqueue.QueueWorker.__init__(self)
+        self.instrument=instrument
+        self.start()
+        # let the thread finish before the interpreter shuts down
+        atexit.register(self.close)
+    def submit(self,func,*args):
+        """
+        queue func(instrument,*args); returns a Job
+        """
+        return self.put(func,args)
+    def close(self,timeout=1.):
+        """
+        stop the thread, once the queued functions are done, and wait for
+        it (at most timeout sec)
+        """
+        self.stop()
+        self.join(timeout)
+    def do(self,func,args):
+        return func(self.instrument,*args)
+
+class Barrier:
+    """
+    lets n threads wait for each other; once all n have called wait,
+    they all go on. It can be used again right away.
+    """
+    def __init__(self,n,timeout=None):
+        """
+        timeout: longest wait (sec) for the others; an exception is
+        raised after that, so one failed thread does not hang the rest
+        """
+        self.n=n
+        self.timeout=timeout
+        self.count=0
+        self.generation=0
+        self.condition=threading.Condition()
+    def wait(self):
+        self.condition.acquire()
+        try:
+            generation=self.generation
+            self.count+=1
+            if self.count==self.n:
+                self.count=0
+                self.generation+=1
+                self.condition.notifyAll()
+                return
+            # see ticker: exact wake-up when the last one arrives
+            if not ticker.wait(self.condition,
+                               lambda: generation!=self.generation,
+                               self.timeout):
+                self.count-=1
+                raise Exception, "barrier: timed out waiting for the others"
+        finally:
+            self.condition.release()
+
+def settleFactor(poles,accuracy):
+    """
+    time, in time constants, for the step response of poles cascaded RC
+    filters to get within accuracy (a fraction of the step) of its
+    final value: the smallest x with exp(-x) sum_{k<poles} x^k/k! below
+    accuracy
+    """
+    def error(x):
+        term=1.
+        total=1.
+        for k in range(1,poles):
+            term*=x/k
+            total+=term
+        return math.exp(-x)*total
+    (lo,hi)=(0.,1.)
+    while error(hi)>accuracy:
+        (lo,hi)=(hi,2*hi)
+    # bisect to well below the resolution that matters
+    while hi-lo>1e-3:
+        mid=(lo+hi)/2.
+        if error(mid)>accuracy:
+            lo=mid
+        else:
+            hi=mid
+    return hi
+
+def filters(lockin):
+    """
+    (time constant in sec, SLOPE setting) of lockin's output filter,
+    read (TC., SLOPE) the first time only; call forgetFilters after
+    changing them
+    """
+    FILTERSLOCK.acquire()
+    try:
+        cached=FILTERS.get(lockin)
+    finally:
+        FILTERSLOCK.release()
+    if cached is None:
+        (tc,)=lockin.ask_for_values("TC.")
+        (slope,)=lockin.ask_for_values("SLOPE")
+        cached=(tc,int(slope))
+        FILTERSLOCK.acquire()
+        FILTERS[lockin]=cached
+        FILTERSLOCK.release()
+    return cached
+
+def forgetFilters(lockin=None):
+    """
+    drop the filter settings read by filters, for lockin (all lock-ins
+    if None)
+    """
+    FILTERSLOCK.acquire()
+    try:
+        if lockin is None:
+            FILTERS.clear()
+        else:
+            FILTERS.pop(lockin,None)
+    finally:
+        FILTERSLOCK.release()
+
+def settleTime(lockin,accuracy=ACCURACY,tc=None,slope=None,step=1.):
+    """
+    seconds lockin's outputs take to settle to within accuracy of their
+    final value after a change of step times that value; the time
+    constant and slope are those of filters(lockin) unless given
+    """
+    if step<=accuracy:
+        return 0.
+    if tc is None or slope is None:
+        (t,n)=filters(lockin)
+        if tc is None:
+            tc=t
+        if slope is None:
+            slope=n
+    return tc*settleFactor(POLES[int(slope)],accuracy/step)
+
+def settle(lockin,accuracy=ACCURACY,converge=False,tc=None,slope=None,
+           step=1.):
+    """
+    wait for lockin's outputs to settle after a change, for the time
+    settleTime gives (step: size of the change relative to the final
+    value, if known to be small). With converge, XY. is read every time
+    constant instead, and the wait ends early once two successive
+    readings agree to within accuracy of the magnitude (as the step
+    response changes by about its remaining error over one time
+    constant). Returns the time waited.
+    """
+    if tc is None:
+        tc=filters(lockin)[0]
+    wait=settleTime(lockin,accuracy,tc,slope,step)
+    if not converge:
+        time.sleep(wait)
+        return wait
+    start=time.time()
+    # the response of more than one pole starts out flat; do not read
+    # before it gets going
+    time.sleep(min(tc,wait))
+    (x0,y0)=lockin.ask_for_values("XY.")
+    while time.time()-start<wait:
+        time.sleep(max(0.,min(tc,wait-(time.time()-start))))
+        (x,y)=lockin.ask_for_values("XY.")
+        if math.hypot(x-x0,y-y0) <= accuracy*math.hypot(x,y):
+            break
+        (x0,y0)=(x,y)
+    return time.time()-start
+
+def pause(lockin,wait=None,step=1.,accuracy=ACCURACY,converge=False):
+    """
+    wait wait sec, or until lockin's outputs settle (see settle) if None
+    """
+    if wait is None:
+        settle(lockin,accuracy,converge,step=step)
+    else:
+        time.sleep(wait)
+
+def follow(lockin,before,wait=None,accuracy=ACCURACY,converge=False):
+    """
+    pause (see pause) after a change from outputs before (X, Y), and
+    read XY.; when waiting for the outputs to settle, and the change
+    turns out larger than what they settled to (e.g. from a strong
+    harmonic to a weak one), wait on until it is down to accuracy of
+    them too. Returns the (X, Y) read last.
+    """
+    pause(lockin,wait,1.,accuracy,converge)
+    (x,y)=lockin.ask_for_values("XY.")
+    if wait is not None:
+        return (x,y)
+    change=math.hypot(x-before[0],y-before[1])
+    # no signal at all does not make the wait endless: the change is
+    # taken down to accuracy of itself at most
+    r=max(math.hypot(x,y),accuracy*change)
+    if change>r:
+        time.sleep(settleTime(lockin,accuracy,step=change/r)
+                   -settleTime(lockin,accuracy))
+        (x,y)=lockin.ask_for_values("XY.")
+    return (x,y)
+
+def phaseLoop(lockin,wait=None,tries=10,tolerance=0.01,step=1.,
+              accuracy=ACCURACY,converge=False):
+    """
+    auto-phase lockin (AQN) and read XY. after pause(wait); repeat until
+    Y is within tolerance of X, up to tries more times. step: expected
+    size of the first change; accuracy, converge: see settle. Returns
+    whether the phase converged.
+    """
+    lockin.write("AQN")
+    pause(lockin,wait,step,accuracy,converge)
+    (x,y)=lockin.ask_for_values("XY.")
+    i=0
+    while abs(y) > (abs(x) * tolerance):
+        if i >= tries:
+            return False
+        lockin.write("AQN")
+        # phasing again only turns Y (by about y/r) into X
+        pause(lockin,wait,abs(y)/math.hypot(x,y),accuracy,converge)
+        (x,y)=lockin.ask_for_values("XY.")
+        i+=1
+    return True
+
+def autophase(lockin,harmonic,wait=None,tries=10,tolerance=0.01,
+              accuracy=ACCURACY,converge=False):
+    """
+    switch lockin to harmonic and auto-phase it (AQN), waiting wait sec
+    (or until the outputs settle, see settle, if None) before reading
+    XY.; repeat AQN until Y is within tolerance of X, up to tries more
+    times. Returns whether the phase converged.
+    """
+    lockin.write("REFN %d" % harmonic)
+    pause(lockin,wait,1.,accuracy,converge)
+    return phaseLoop(lockin,wait,tries,tolerance,1.,accuracy,converge)
+
+class PhaseManager:
+    """
+    remembers the reference phase (REFP.) auto-phasing found for each
+    lock-in and harmonic. On a switch the phase is set straight away;
+    AQN is only used when Y has drifted past tolerance of X, and the
+    phase it then finds is kept.
+    """
+    def __init__(self,tries=10,tolerance=0.01):
+        self.tries=tries
+        self.tolerance=tolerance
+        # degrees, by (lock-in, harmonic)
+        self.phases={}
+        # switches done with the stored phase, and with auto-phasing
+        self.restored=0
+        self.autophased=0
+    def restore(self,lockin,harmonic):
+        """
+        switch lockin to harmonic, with the stored phase if there is one;
+        returns whether there was
+        """
+        lockin.write("REFN %d" % harmonic)
+        phase=self.phases.get((lockin,harmonic))
+        if phase is None:
+            return False
+        lockin.write("REFP. %.3f" % phase)
+        return True
+    def autophase(self,lockin,harmonic,wait=None,accuracy=ACCURACY,
+                  converge=False):
+        """
+        as autophase (the function), but starting from the stored phase
+        """
+        step=1.
+        before=lockin.ask_for_values("XY.")
+        if self.restore(lockin,harmonic):
+            (x,y)=follow(lockin,before,wait,accuracy,converge)
+            if abs(y) <= (abs(x) * self.tolerance):
+                self.restored+=1
+                return True
+            # the phase drifted; the rest is a small correction
+            step=abs(y)/math.hypot(x,y)
+        else:
+            pause(lockin,wait,1.,accuracy,converge)
+        self.autophased+=1
+        converged=phaseLoop(lockin,wait,self.tries,self.tolerance,step,
+                            accuracy,converge)
+        if converged:
+            (self.phases[(lockin,harmonic)],)=lockin.ask_for_values("REFP.")
+        return converged
+    def forget(self):
+        """
+        drop the stored phases, e.g. after changing the optics
+        """
+        self.phases={}
+
+def measure(lockin,harmonic,wait=None,barrier=None,phases=None,
+            accuracy=ACCURACY,converge=False):
+    """
+    auto-phase lockin on harmonic (see autophase; with phases, a
+    PhaseManager, starting from the stored phase), wait at barrier (if
+    any) for the other lock-ins, then read it. accuracy, converge: of
+    the settling waits if wait is None (see settle).
+    Returns (t, x, y, mag): t is the time of the reading; mag is the
+    magnitude signed as x if the phase did not converge, else None.
+    """
+    if phases is None:
+        converged=autophase(lockin,harmonic,wait,accuracy=accuracy,
+                            converge=converge)
+    else:
+        converged=phases.autophase(lockin,harmonic,wait,accuracy,converge)
+    if barrier is not None:
+        barrier.wait()
+    t=time.time()
+    (x,y)=lockin.ask_for_values("XY.")
+    mag=None
+    if not converged:
+        (m,)=lockin.ask_for_values("MAG.")
+        mag=m*abs(x)/(x)
+    return (t,x,y,mag)
+
+# bits of the curve buffer definition (CBD) for the curves CurveBuffer
+# handles; the sensitivity curve is needed to scale X, Y and MAG
+CURVES={'X':0,'Y':1,'MAG':2,'PHA':3,'SEN':4,'ADC1':5,'ADC2':6}
+
+def sensitivity(n):
+    """
+    full scale (V) of voltage-input sensitivity setting n (SEN n): 2 nV
+    for n=1 up to 1 V for n=27, in 1-2-5 steps; n can be an array
+    """
+    n=numpy.asarray(n)
+    return numpy.array((2,5,10))[(n-1)%3]*10.**((n-1)//3)*1e-9
+
+class CurveBuffer:
+    """
+    acquisition through the lock-in's curve buffer: the lock-in stores
+    length points of each curve, one every interval sec (a multiple of
+    5 ms), then the curves are read out in binary.
+
+        buf=CurveBuffer(lockin,('X','Y','MAG','ADC1'),1000,0.005)
+        data=buf.acquire()
+        data['X']   # volts, a numpy array; data['t']: sec from the start
+    """
+    def __init__(self,lockin,curves=('X','Y','MAG','ADC1'),length=1000,
+                 interval=0.005):
+        self.lockin=lockin
+        self.curves=tuple(curves)
+        self.length=length
+        # the storage interval is set in ms, in steps of 5 ms
+        self.interval=max(5,int(round(interval*200))*5)/1000.
+        self.started=None
+    def arm(self):
+        """
+        define the curves, length and interval, and clear the buffer
+        """
+        mask=1<<CURVES['SEN']
+        for curve in self.curves:
+            mask|=1<<CURVES[curve]
+        self.lockin.write("CBD %d" % mask)
+        self.lockin.write("LEN %d" % self.length)
+        self.lockin.write("STR %d" % int(round(self.interval*1000)))
+        self.lockin.write("NC")
+    def start(self):
+        """
+        start taking data
+        """
+        self.lockin.write("TD")
+        self.started=time.time()
+    def status(self):
+        """
+        (acquisition status, sweeps done, status byte, points stored);
+        the status is 0 once the buffer is full
+        """
+        return tuple([int(v) for v in self.lockin.ask_for_values("M")])
+    def wait(self,timeout=None):
+        """
+        wait until all points are stored; returns the number stored
+        """
+        if timeout is None:
+            timeout=2*self.length*self.interval+10
+        # most of the time is known in advance; sleep through it, then
+        # poll
+        time.sleep(max(self.started+self.length*self.interval-time.time(),0))
+        while True:
+            (status,sweeps,byte,points)=self.status()
+            if status==0:
+                return points
+            if time.time()-self.started>timeout:
+                raise Exception, "curve buffer: acquisition timed out"
+            time.sleep(max((self.length-points)*self.interval,self.interval))
+    def dump(self,curve,points):
+        """
+        read points values of curve (a name in CURVES) in binary; returns
+        the raw integers
+        """
+        self.lockin.write("DCB %d" % CURVES[curve])
+        raw=self.lockin.read_raw()
+        # two bytes per point, most significant first
+        return numpy.frombuffer(raw[:2*points],'>i2',points).astype(int)
+    def fetch(self,points=None):
+        """
+        read out the curves; returns a dict of numpy arrays by curve
+        name, plus 't', the sample times (sec) from the start. X, Y and
+        MAG are in volts, PHA in degrees, ADC1/ADC2 in volts.
+        """
+        if points is None:
+            points=self.status()[3]
+        data={'t':numpy.arange(points)*self.interval}
+        full=sensitivity(1)*numpy.ones(points)
+        if set(self.curves)&set(('X','Y','MAG')):
+            full=sensitivity(self.dump('SEN',points))
+        for curve in self.curves:
+            raw=self.dump(curve,points)
+            if curve in ('X','Y','MAG'):
+                # +-10000 is full scale
+                data[curve]=raw*full/10000.
+            elif curve=='PHA':
+                data[curve]=raw/100.
+            elif curve in ('ADC1','ADC2'):
+                data[curve]=raw/1000.
+            else:
+                data[curve]=raw
+        return data
+    def acquire(self):
+        """
+        arm, start, wait and fetch (see fetch)
+        """
+        self.arm()
+        self.start()
+        return self.fetch(self.wait())
@@ -0,0 +1,170 @@
+"""
+buffered log files, written out by a background thread so the control
+and measurement loops do not wait on the disk.
+
+Lines are queued with write (text as is) or record (comma separated
+values, with a timestamp); they are written when enough has piled up
+(flushSize bytes) or enough time has passed (flushInterval sec), on
+flush(), and at exit. Files can be rotated by size or by day.
+
+    log=logwriter.shared()
+    log.record("oven.txt",(T,setpoint))
+"""
+import os, time, threading, Queue, atexit
+
+class LogWriter(threading.Thread):
+    def __init__(self,flushSize=65536,flushInterval=5.,rotateSize=None,
+                 rotateDaily=False,clock=time):
+        """
+        flushSize: bytes buffered before they are written out
+        flushInterval: longest time (sec) a line stays in the buffer
+        rotateSize: once a file would grow past this many bytes, it is
+                    renamed to name.1.ext (name.2.ext, ...) and a new one
+                    started; None to never rotate by size
+        rotateDaily: if True, the date is added to file names
+                     (name-YYYYMMDD.ext), so a new file starts every day
+        clock: provides time() for the timestamps
+        """
+        threading.Thread.__init__(self)
+        self.daemon=True
+        self.flushSize=flushSize
+        self.flushInterval=flushInterval
+        self.rotateSize=rotateSize
+        self.rotateDaily=rotateDaily
+        self.clock=clock
+        self.queue=Queue.Queue()
+        # lines waiting to be written, by file name
+        self.buffer={}
+        self.buffered=0
+        self.lastFlush=time.time()
+        self.written=0
+        self.errors=0
+        self.running=False
+    def write(self,filename,text):
+        """
+        queue text to be appended to filename (relative to the current
+        directory at the time of the call)
+        """
+        self.queue.put((os.path.abspath(filename),text))
+    def record(self,filename,values,stamp=True):
+        """
+        queue one line of comma separated values; it starts with the
+        time (to the ms) if stamp is True (now) or a number (that time)
+        """
+        fields=["%g" % v for v in values]
+        if stamp is True:
+            stamp=self.clock.time()
+        if stamp is not False:
+            fields.insert(0,"%.3f" % stamp)
+        self.write(filename,",".join(fields)+"\n")
+    def flush(self,timeout=None):
+        """
+        write out everything queued so far; returns once that is done
+        """
+        if not self.running:
+            self.drain()
+            self.writeBuffer()
+            return
+        done=threading.Event()
+        self.queue.put((None,done))
+        done.wait(timeout)
+    def start(self):
+        self.running=True
+        threading.Thread.start(self)
+        atexit.register(self.close)
+    def close(self):
+        """
+        write out everything and stop the thread
+        """
+        if self.running:
+            self.running=False
+            self.queue.put((None,None))
+            self.join()
+        self.drain()
+        self.writeBuffer()
+    def run(self):
+        while self.running:
+            wait=self.flushInterval-(time.time()-self.lastFlush)
+            try:
+                item=self.queue.get(True,max(wait,0.01))
+            except Queue.Empty:
+                item=None
+            if item is not None:
+                (filename,text)=item
+                if filename is None:
+                    # flush request (or close, with no event)
+                    self.drain()
+                    self.writeBuffer()
+                    if text is not None:
+                        text.set()
+                    continue
+                self.add(filename,text)
+            if (self.buffered>=self.flushSize or
+                time.time()-self.lastFlush>=self.flushInterval):
+                self.writeBuffer()
+    def add(self,filename,text):
+        self.buffer.setdefault(filename,[]).append(text)
+        self.buffered+=len(text)
+    def drain(self):
+        """
+        move whatever is in the queue to the buffer
+        """
+        while True:
+            try:
+                (filename,text)=self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            if filename is None:
+                if text is not None:
+                    text.set()
+                continue
+            self.add(filename,text)
+    def writeBuffer(self):
+        (buffer,self.buffer)=(self.buffer,{})
+        self.buffered=0
+        self.lastFlush=time.time()
+        for (filename,lines) in buffer.items():
+            text="".join(lines)
+            try:
+                path=self.path(filename,len(text))
+                fout=open(path,'a')
+                fout.write(text)
+                fout.close()
+                self.written+=len(text)
+            except:
+                self.errors+=1
+                print("FILE OUTPUT FAILED for %s, trying to continue" % filename)
+    def path(self,filename,size):
+        """
+        file to append size bytes of filename to, rotating as set up
+        """
+        (base,ext)=os.path.splitext(filename)
+        if self.rotateDaily:
+            base="%s-%s" % (base,time.strftime("%Y%m%d",
+                                               time.localtime(self.clock.time())))
+        path=base+ext
+        if (self.rotateSize is not None and os.path.exists(path) and
+            os.path.getsize(path)+size>self.rotateSize):
+            n=1
+            while os.path.exists("%s.%d%s" % (base,n,ext)):
+                n+=1
+            os.rename(path,"%s.%d%s" % (base,n,ext))
+        return path
+
+__shared__=None
+__sharedLock__=threading.Lock()
+
+def shared():
+    """
+    the LogWriter shared by the modules in this directory, started on
+    first use
+    """
+    global __shared__
+    __sharedLock__.acquire()
+    try:
+        if __shared__ is None:
+            __shared__=LogWriter()
+            __shared__.start()
+        return __shared__
+    finally:
+        __sharedLock__.release()
@@ -3,7 +3,8 @@ Classes and functions for controlling the trash-can oven. Needs a
 temperature controller for measuring the oven temperature and a DAQ for
 sending +5V (min. +3V) signal to the oven heater relay.
 """
-import re, threading, time, usb.core, usb.util, struct
+import re, threading, time, usb.core, usb.util, struct, math
+import thermocouple, logwriter, jobqueue
 
 # constants for USB-2001-TC
 ID="TC"
@@ -15,19 +16,6 @@ CTRLIN=192
 STR=0x80
 RAW=0x81
 BUFFERSIZE=64
-# constants for type K (voltages are given in mV)
-RANGES=(
-    (-5.891,0.0),
-    (0.0,20.644),
-    (20.644,54.886));
-COEFFS=(
-    (0.0,25.173462,-1.1662878,-1.0833638,-8.9773540,
-     -3.7342377,-8.6632643,-1.0450598,-5.1920577,0.0),
-    (0.0,25.08355,0.07860106,-0.2503131,0.08315270,
-     -0.01228034,0.0009804036,-0.00004413030,
-     1.057734E-06,-1.052755E-08),
-    (-131.8058,48.30222,-1.646031,0.05464731,-0.0009650715,
-     8.802193E-06,-3.110810E-08,0.0,0.0,0.0));
 # constants for SIIG USB hub
 HUBVENDOR=0x2109
 HUBPRODUCT=0x3431
@@ -37,123 +25,284 @@ CLEAR_FEATURE=1
 SET_FEATURE=3
 PORT=1
 
-class Oven:
+# result of a command queued on a TCWorker
+Future=jobqueue.Future
+
+class TCWorker(jobqueue.QueueWorker):
+    """
+    I/O thread that owns USB-2001-TC devices; every transfer goes
+    through its queue, so threads can share a device without locks.
+    Identical queries waiting in the queue at the same time are done
+    once, and all callers get the same result.
+    """
     def __init__(self):
+        jobqueue.QueueWorker.__init__(self)
+        # queries waiting in the queue, by (device, kind, command)
+        self.pending={}
+        self.pendingLock=threading.Lock()
+        self.errors=0
+    def submit(self,tc,kind,cmd,arg=None):
+        """
+        queue a command for device tc and return a Future.
+        kind: 'write' (arg: expected response or None), 'read' (string
+        response), 'float' or 'int' (raw response), 'burst' (arg
+        repetitions of an 'int' query; a list), 'batch' (arg is a list of
+        (tc, kind, cmd, arg) commands, done back to back; a list of
+        their results; tc and cmd are ignored)
+        """
+        key=None
+        if kind in ('read','float','int'):
+            key=(id(tc),kind,cmd)
+        self.pendingLock.acquire()
+        try:
+            if key in self.pending:
+                return self.pending[key]
+            future=Future()
+            if key is not None:
+                self.pending[key]=future
+        finally:
+            self.pendingLock.release()
+        return self.put(key,tc,kind,cmd,arg,future=future)
+    def do(self,key,tc,kind,cmd,arg):
+        # from now on, the same query needs a new transfer
+        self.pendingLock.acquire()
+        self.pending.pop(key,None)
+        self.pendingLock.release()
+        return self.transfer(tc,kind,cmd,arg)
+    def failed(self):
+        # give the device a moment before the next command
+        self.errors+=1
+        time.sleep(0.1)
+    def transfer(self,tc,kind,cmd,arg):
+        """
+        do the USB transfers of one command
+        """
+        if kind == 'burst':
+            return [self.transfer(tc,'int',cmd,None) for j in range(arg)]
+        if kind == 'batch':
+            return [self.transfer(*job) for job in arg]
+        # write the command
+        assert tc.ctrl_transfer(CTRLOUT,STR,0,0,cmd) == len(cmd)
+        if kind == 'write':
+            # if arg (i.e. the expected response) is not None, then read
+            # a message and verify that we get expected response back
+            if arg is not None:
+                msg=tc.ctrl_transfer(CTRLIN,STR,0,0,BUFFERSIZE)
+                assert msg[-1] == 0
+                assert arg == struct.pack("="+str(len(msg)-1)+"b",
+                                          *msg[0:-1])
+            return None
+        elif kind == 'read':
+            msg=tc.ctrl_transfer(CTRLIN,STR,0,0,BUFFERSIZE)
+            return struct.pack("="+str(len(msg)-1)+"b",*msg[0:-1])
+        msg=tc.ctrl_transfer(CTRLIN,RAW,0,0,BUFFERSIZE)
+        if kind == 'float':
+            return struct.unpack("=1f",msg)[0]
+        return struct.unpack("=1I",msg)[0]
+
+def findTCs():
+    """
+    all USB-2001-TC devices connected, as a list
+    """
+    return list(usb.core.find(find_all=True,idVendor=IDVENDOR,
+                              idProduct=IDPRODUCT))
+
+def readTemperatures(ovens):
+    """
+    read the temperatures of ovens in 'burst' mode, all in one job of
+    their (shared) TCWorker; sets and returns their T
+    """
+    worker=ovens[0].worker
+    jobs=[]
+    for oven in ovens:
+        assert oven.worker is worker
+        jobs.extend(oven.burstJobs())
+    results=worker.submit(None,'batch',None,jobs).result()
+    for (j,oven) in enumerate(ovens):
+        oven.cjc=results[2*j]
+        oven.convert(oven.scaled(results[2*j+1]))
+    return [oven.T for oven in ovens]
+
+class Oven:
+    def __init__(self,worker=None,clock=time,device=None,channel=0,
+                 port=PORT):
         """
         initialize device connections; define variables
+        worker: TCWorker to do the USB-2001-TC transfers; one is started
+        if None (several Oven objects may share one)
+        clock: provides time() and sleep(); the time module, or a
+        simulated clock (see simulators.VirtualClock)
+        device: USB-2001-TC to read (see findTCs); the first one found
+        if None
+        channel: thermocouple input of the device
+        port: SIIG hub port powering the heater relay
         """
+        self.clock=clock
+        self.channel=channel
+        self.port=port
         # INITIALIZE USB-2001-TC thermocouple controller
-        self.tc=usb.core.find(idVendor=IDVENDOR,idProduct=IDPRODUCT)
+        if device is None:
+            device=usb.core.find(idVendor=IDVENDOR,idProduct=IDPRODUCT)
+        self.tc=device
         self.tc.set_configuration()
+        if worker is None:
+            worker=TCWorker()
+            worker.start()
+        self.worker=worker
         # set the sensor type to K
-        self.tcLock=threading.Lock()
-        self.tcWrite("AI{0}:SENSOR=TC/K")
+        self.tcWrite("AI{%d}:SENSOR=TC/K" % self.channel)
         # INITIALIZE SIIG hub
         self.hub=usb.core.find(idVendor=HUBVENDOR,idProduct=HUBPRODUCT)
         # start out with relay turned off
         self.relayState=0
         self.hub.ctrl_transfer(HUB_REQUEST_TYPE,CLEAR_FEATURE,
-                               USB_PORT_FEAT_POWER,PORT,"")
+                               USB_PORT_FEAT_POWER,self.port,"")
+        # how getT samples the voltage:
+        # 'fixed': samples readings, sampleDelay seconds apart
+        # 'burst': samples readings back to back, in one USB job
+        # 'adaptive': readings sampleDelay apart until the standard error
+        #    of the mean temperature is below tolerance (degC), using
+        #    between minSamples and samples readings
+        # readings closer together than the conversion time repeat the
+        # last conversion; those repeats are not counted (see distinct)
+        self.mode='fixed'
+        self.samples=100
+        self.sampleDelay=0.01
+        self.minSamples=10
+        self.tolerance=0.05
+        # readings used by the last getT, and its standard error (degC)
+        self.nSamples=0
+        self.sem=0.
     def tcWrite(self,cmd,msgin=None):
         """
         write a command to USB-2001-TC and verify that it's been processed
         """
-        self.tcLock.acquire()
-        # write the command
-        assert self.tc.ctrl_transfer(CTRLOUT,STR,0,0,cmd) == len(cmd)
-        # if msgin (i.e. the expected response) is not None, then read a
-        # message and verify that we get expected response back
-        if msgin is not None:
-            msg=self.tc.ctrl_transfer(CTRLIN,STR,0,0,BUFFERSIZE)
-            assert msg[-1] == 0
-            assert msgin == struct.pack("="+str(len(msg)-1)+"b",
-                                        *msg[0:-1])
-        self.tcLock.release()
+        self.worker.submit(self.tc,'write',cmd,msgin).result()
     def tcRead(self,cmd):
         """
         write a command to USB-2001-TC and read a response
         """
-        self.tcLock.acquire()
-        # write the command
-        assert self.tc.ctrl_transfer(CTRLOUT,STR,0,0,cmd) == len(cmd)
-        msg=self.tc.ctrl_transfer(CTRLIN,STR,0,0,BUFFERSIZE)
-        self.tcLock.release()
-        return struct.pack("="+str(len(msg)-1)+"b",*msg[0:-1])
+        return self.worker.submit(self.tc,'read',cmd).result()
     def tcReadFloat(self,cmd):
         """
         write a command to USB-2001-TC and read a raw response that is a
         floading point number
         """
-        self.tcLock.acquire()
-        # write the command
-        assert self.tc.ctrl_transfer(CTRLOUT,STR,0,0,cmd) == len(cmd)
-        msg=self.tc.ctrl_transfer(CTRLIN,RAW,0,0,BUFFERSIZE)
-        self.tcLock.release()
-        return struct.unpack("=1f",msg)[0]
+        return self.worker.submit(self.tc,'float',cmd).result()
     def tcReadInt(self,cmd):
         """
         write a command to USB-2001-TC and read a raw response that is
         an unsigned integer
         """
-        self.tcLock.acquire()
-        # write the command
-        assert self.tc.ctrl_transfer(CTRLOUT,STR,0,0,cmd) == len(cmd)
-        msg=self.tc.ctrl_transfer(CTRLIN,RAW,0,0,BUFFERSIZE)
-        self.tcLock.release()
-        return struct.unpack("=1I",msg)[0]
+        return self.worker.submit(self.tc,'int',cmd).result()
     def getmV(self):
         """
         read voltage from temperature controller
         """
         # unscaled integer reading
-        val=self.tcReadInt("?AI{0}:VALUE")-2**19
-        # scale it to the actual mV scale
+        return self.scaled([self.tcReadInt("?AI{%d}:VALUE" % self.channel)])[0]
+    def getmVBurst(self,n):
+        """
+        read voltage from temperature controller n times back to back,
+        as one job of the I/O thread; returns a list
+        """
+        vals=self.worker.submit(self.tc,'burst',
+                                "?AI{%d}:VALUE" % self.channel,n).result()
+        return self.scaled(vals)
+    def scaled(self,vals):
+        """
+        convert unscaled integer readings to mV
+        """
         scale=73.125/float(2**19)
-        return val*scale        
-    def getT(self):
+        return [(val-2**19)*scale for val in vals]
+    def burstJobs(self):
+        """
+        TCWorker commands reading the cold junction temperature and a
+        burst of samples voltages, as getT does in 'burst' mode (see
+        readTemperatures)
+        """
+        return [(self.tc,'float',"?AI{%d}:CJC" % self.channel,None),
+                (self.tc,'burst',"?AI{%d}:VALUE" % self.channel,self.samples)]
+    def getT(self,mode=None):
         """
         read temperature and return it
+        mode: 'fixed', 'burst' or 'adaptive' (see __init__); default is
+        self.mode. The number of readings averaged is left in
+        self.nSamples. Readings closer together than the conversion time
+        of the USB-2001-TC repeat the same value; only distinct
+        conversions are averaged and counted (see distinct).
         """
-        # read the voltage 100 times and average
-        self.mV=0.
-        j=0
-        while j < 100:
-            try:
-                self.mV+=self.getmV()
-                j+=1
-                time.sleep(0.01)
-            except:
-                # silently ignore; wait 100 mS, clear locks and retry
-                time.sleep(0.1)
-                self.tcLock.release()
-        self.mV=self.mV/float(j)
-        # determine the coefficients to use
-        j=0
-        while not (RANGES[j][0]<=self.mV and self.mV<=RANGES[j][1]):
-            if j==len(RANGES)-1:
-                break
-            j+=1
-        activeCoeffs=COEFFS[j]
-        # calculate the delta T using the coefficients
-        deltaT=0.
-        for j in range(len(activeCoeffs)):
-            deltaT+=activeCoeffs[j]*(self.mV**float(j))
-        # get the cold junction temperature and add to get temperature in degC
-        self.T=self.tcReadFloat("?AI{0}:CJC")+deltaT        
+        if mode is None:
+            mode=self.mode
+        # get the cold junction temperature; its thermocouple voltage is
+        # added before converting to temperature in degC (type K)
+        self.cjc=self.tcReadFloat("?AI{%d}:CJC" % self.channel)
+        if mode == 'burst':
+            readings=self.getmVBurst(self.samples)
+        else:
+            readings=[]
+            while len(readings) < self.samples:
+                try:
+                    readings.append(self.getmV())
+                    self.clock.sleep(self.sampleDelay)
+                except:
+                    # silently ignore; wait 100 mS and retry
+                    self.clock.sleep(0.1)
+                if mode == 'adaptive':
+                    conversions=self.distinct(readings)
+                    if (len(conversions) >= self.minSamples and
+                        self.getSem(conversions) < self.tolerance):
+                        break
+        return self.convert(readings)
+    def convert(self,readings):
+        """
+        set the temperature from readings (mV) and the cold junction
+        temperature in self.cjc; returns it
+        """
+        readings=self.distinct(readings)
+        self.nSamples=len(readings)
+        self.mV=sum(readings)/float(self.nSamples)
+        self.sem=self.getSem(readings)
+        self.T=float(thermocouple.compensated(self.mV,self.cjc))
         return self.T        
+    def distinct(self,readings):
+        """
+        readings without the back-to-back repeats of one conversion (a
+        reading equal to the one before it). Now and then two conversions
+        in a row give the same value (the steps are 0.14 uV); dropping
+        one of them costs a reading, but does not bias the mean
+        """
+        result=readings[:1]
+        for v in readings[1:]:
+            if v != result[-1]:
+                result.append(v)
+        return result
+    def getSem(self,readings):
+        """
+        standard error of the mean temperature of readings (mV)
+        """
+        n=len(readings)
+        if n < 2:
+            return float('inf')
+        mean=sum(readings)/float(n)
+        var=sum([(v-mean)**2 for v in readings])/(n-1)
+        # convert from mV using the local slope of the type K curve
+        dmV=math.sqrt(var/n)
+        T=thermocouple.compensated([mean,mean+dmV],self.cjc)
+        return float(abs(T[1]-T[0]))
     def onRelay(self):
         """
         turn the relay on
         """
         self.hub.ctrl_transfer(HUB_REQUEST_TYPE,SET_FEATURE,
-                               USB_PORT_FEAT_POWER,PORT,"")
+                               USB_PORT_FEAT_POWER,self.port,"")
         self.relayState=1
     def offRelay(self):
         """
         turn the relay off
         """
         self.hub.ctrl_transfer(HUB_REQUEST_TYPE,CLEAR_FEATURE,
-                               USB_PORT_FEAT_POWER,PORT,"")
+                               USB_PORT_FEAT_POWER,self.port,"")
         self.relayState=0
     def toggleRelay(self):
         """
@@ -164,19 +313,81 @@ class Oven:
         else:
             self.offRelay()
     
+# tuning rules for the relay-feedback autotune: (Kp/Ku, Ti/Pu, Td/Pu)
+TUNINGRULES={
+    'ziegler-nichols':(0.6,0.5,0.125),
+    'tyreus-luyben':(1/2.2,2.2,1/6.3),
+    'no-overshoot':(0.2,0.5,1/3.)}
+
 class OvenControl(threading.Thread):
     """
     This class controls oven temperature; supports ramping and
     maintaining the oven temperature at a setpoint.
+
+    Two controllers: 'bangbang' toggles the relay when the temperature
+    leaves the +-deadband band around the setpoint; 'pid' switches the
+    relay on for a fraction (the PID output) of every PWM period. The
+    PID gains can be found with autotune.
+
+    The setpoint follows a queue of (target, duration, hold) segments,
+    interpolated at every tick of the control loop: appendSegment adds
+    to it, cancel empties it. The events reached (setpoint at the
+    segment's target), stable (temperature within stableBand of it for
+    stableTime) and idle (queue done) can be waited on with wait.
     """
-    def __init__(self,oven,outfile=None):
+    def __init__(self,oven,outfile=None,clock=None,log=None):
+        """
+        oven: Oven object to control
+        outfile: file to append time, temperature and setpoint to
+        clock: provides time() and sleep(); default is the oven's clock
+        log: LogWriter for the outfile; default is logwriter.shared()
+        """
         self.outfile=outfile
+        if log is None and outfile is not None:
+            log=logwriter.shared()
+        self.log=log
         self.oven=oven
+        if clock is None:
+            clock=oven.clock
+        self.clock=clock
         # get the inital temperature and set the setpoint there
         self.setpoint=self.oven.getT()
         print("Setpoint: %g" % self.setpoint)
         # allow for +-1 deg variation
         self.deadband=0.5
+        # 'bangbang' or 'pid'; 'relay' while autotuning
+        self.controller='bangbang'
+        # PID gains; output is the fraction of the PWM period (sec) the
+        # relay is on, so kp is per degC, ki per degC sec, kd sec per degC
+        self.kp=0.1
+        self.ki=0.0005
+        self.kd=0.
+        self.period=20.
+        # shortest relay pulse worth switching for (sec)
+        self.minPulse=0.5
+        self.resetPID()
+        # (time, temperature, relay state) while autotuning
+        self.trace=[]
+        # ramp schedule: queued (target, duration, hold, done) segments,
+        # and the one in progress as (start time, start setpoint, target,
+        # duration, hold, done); done is an Event set once the setpoint
+        # gets to the segment's target (or the segment is cancelled)
+        self.segments=[]
+        self.segment=None
+        self.scheduleLock=threading.Lock()
+        # temperature within stableBand (degC) of the target for
+        # stableTime (sec) counts as stable
+        self.stableBand=0.5
+        self.stableTime=300.
+        self.stableSince=None
+        self.reached=threading.Event()
+        self.reached.set()
+        self.stable=threading.Event()
+        self.idle=threading.Event()
+        self.idle.set()
+        # thread running the control loop; a MultiOvenControl, for zones
+        # controlled together
+        self.controlThread=self
         threading.Thread.__init__(self)
     def run(self):
         """
@@ -186,77 +397,368 @@ class OvenControl(threading.Thread):
         self.running=True
         while self.running:
             try:
-                self.maintain_setpoint()
-                if self.outfile is not None:
-                    try:
-                        # write out the temperature to a file
-                        fout=open(self.outfile,'a')
-                        fout.write("%d,%g,%g\n" % (time.time(),self.oven.T,self.setpoint))
-                        fout.close()
-                    except:
-                        print("file output failed, trying to continue")
-                time.sleep(1)
+                self.update_setpoint()
+                if self.controller=='pid':
+                    self.pwm_cycle()
+                else:
+                    self.maintain_setpoint()
+                self.log_state()
+                if self.controller!='pid':
+                    # the PWM cycle sets the pace otherwise
+                    self.clock.sleep(1)
             except:
                 print("maintaining setpoint failed, trying to continue (turning off oven for now)")
                 self.oven.offRelay()
-    def maintain_setpoint(self):
+    def log_state(self):
+        """
+        record the temperature after a control step: in the trace while
+        autotuning, and in the outfile
+        """
+        if self.controller=='relay':
+            self.trace.append((self.clock.time(),self.oven.T,
+                               self.oven.relayState))
+        if self.outfile is not None:
+            # queue the temperature for the file; the log writer
+            # thread does the writing
+            self.log.record(self.outfile,(self.oven.T,self.setpoint),
+                            self.clock.time())
+    def maintain_setpoint(self,T=None):
         """
         maintain the setpoint by deciding whether to toggle the relay state
+        T: temperature to decide on; read from the oven if None
         """
+        if T is None:
+            T=self.oven.getT()
         # check the relay state and get comparison of current
         # temperature and the setpoint
         if self.oven.relayState==1:
             # relay is on, toggle if current temperature is too high
-            if self.oven.getT() > self.setpoint+self.deadband:
+            if T > self.setpoint+self.deadband:
                 self.oven.toggleRelay()
         else:
             # relay is off, toggle if current temperature is too low
-            if self.oven.getT() < self.setpoint-self.deadband:
+            if T < self.setpoint-self.deadband:
                 self.oven.toggleRelay()
+    def resetPID(self):
+        """
+        forget the PID state (integral and last reading)
+        """
+        self.integral=0.
+        self.lastT=None
+        self.lastTime=None
+        self.output=0.
+    def pid(self,T,now):
+        """
+        PID output (0 to 1) for temperature T at time now. The derivative
+        acts on the temperature, not the error, so setpoint steps during
+        ramps do not kick the output; the integral stops growing while the
+        output is saturated (anti-windup).
+        """
+        error=self.setpoint-T
+        if self.lastTime is None or now<=self.lastTime:
+            dt=0.
+            derivative=0.
+        else:
+            dt=now-self.lastTime
+            derivative=-(T-self.lastT)/dt
+        (self.lastT,self.lastTime)=(T,now)
+        p=self.kp*error
+        d=self.kd*derivative
+        step=self.ki*error*dt
+        output=p+self.integral+step+d
+        # only integrate if that does not push the output further past
+        # its limits
+        if (output<1 or step<0) and (output>0 or step>0):
+            self.integral+=step
+        self.integral=min(max(self.integral,0.),1.)
+        self.output=min(max(p+self.integral+d,0.),1.)
+        return self.output
+    def pwm_cycle(self):
+        """
+        one PWM period: read the temperature, then keep the relay on for
+        the PID output's fraction of the period and off for the rest
+        """
+        T=self.oven.getT()
+        now=self.clock.time()
+        off=self.pwm_start(T,now)
+        if off is not None:
+            self.clock.sleep(max(0.,off-self.clock.time()))
+            self.oven.offRelay()
+        self.clock.sleep(max(0.,now+self.period-self.clock.time()))
+    def pwm_start(self,T,now):
+        """
+        start a PWM period at time now, with temperature T: switch the
+        relay as the PID output says; returns when to switch it off, or
+        None if it stays as it is for the whole period
+        """
+        on=self.pid(T,now)*self.period
+        if on<self.minPulse:
+            # too short to bother switching on
+            self.oven.offRelay()
+            return None
+        self.oven.onRelay()
+        if self.period-on<self.minPulse:
+            return None
+        return now+on
+    def autotune(self,cycles=3,hysteresis=None,rule='tyreus-luyben',
+                 timeout=4*3600):
+        """
+        find PID gains by a relay-feedback test around the current
+        setpoint: the relay is toggled as by the bang-bang controller
+        (with +-hysteresis, default deadband), which makes the
+        temperature oscillate; from the amplitude a and period Pu of the
+        oscillation, the ultimate gain is Ku=4d/(pi sqrt(a^2-h^2)), with
+        d=0.5 for a relay switching the output between 0 and 1.
+        The gains are set from Ku and Pu by rule (see TUNINGRULES), and
+        the controller is switched to 'pid'. cycles oscillations are
+        used, after one to settle; returns (Ku, Pu).
+        """
+        # make sure that thread is running to toggle the relay
+        assert self.controlThread.isAlive()
+        if hysteresis is None:
+            hysteresis=self.deadband
+        (kpu,tiu,tdu)=TUNINGRULES[rule]
+        (deadband,self.deadband)=(self.deadband,hysteresis)
+        self.trace=[]
+        self.controller='relay'
+        start=self.clock.time()
+        try:
+            while True:
+                self.clock.sleep(self.period)
+                trace=list(self.trace)
+                # times the relay was switched on
+                ons=[trace[j][0] for j in range(1,len(trace))
+                     if trace[j][2]==1 and trace[j-1][2]==0]
+                if len(ons)>=cycles+2:
+                    break
+                if self.clock.time()-start>timeout:
+                    raise Exception, "autotune: no oscillation within timeout"
+        finally:
+            self.controller='bangbang'
+            self.deadband=deadband
+        T=[x[1] for x in trace if ons[1]<=x[0]<ons[-1]]
+        a=(max(T)-min(T))/2.
+        if a<=hysteresis:
+            raise Exception, "autotune: oscillation within the hysteresis"
+        Pu=(ons[-1]-ons[1])/(len(ons)-2.)
+        Ku=4*0.5/(math.pi*math.sqrt(a**2-hysteresis**2))
+        self.kp=kpu*Ku
+        self.ki=self.kp/(tiu*Pu)
+        self.kd=self.kp*tdu*Pu
+        print("autotune: Ku=%g Pu=%g s; kp=%g ki=%g kd=%g" %
+              (Ku,Pu,self.kp,self.ki,self.kd))
+        self.resetPID()
+        self.controller='pid'
+        return (Ku,Pu)
+    def appendSegment(self,target,duration,hold=0):
+        """
+        queue a ramp to target over duration (sec), then hold there for
+        hold sec before moving on to the next segment. The events refer
+        to the segment in progress, so after queuing onto an idle
+        schedule they are cleared right away. Returns an Event set once
+        the setpoint is at this segment's target.
+        """
+        done=threading.Event()
+        self.scheduleLock.acquire()
+        try:
+            self.segments.append((target,duration,hold,done))
+            if self.segment is None:
+                self.reached.clear()
+                self.stable.clear()
+            self.idle.clear()
+        finally:
+            self.scheduleLock.release()
+        return done
+    def cancel(self):
+        """
+        drop the queued segments and the one in progress; the setpoint
+        stays where it is
+        """
+        self.scheduleLock.acquire()
+        try:
+            # release whoever waits on the dropped segments
+            if self.segment is not None:
+                self.segment[-1].set()
+            for segment in self.segments:
+                segment[-1].set()
+            self.segments=[]
+            self.segment=None
+            self.reached.set()
+            self.stableSince=None
+            self.idle.set()
+        finally:
+            self.scheduleLock.release()
+        print("Ramp schedule cancelled; setpoint: %g" % self.setpoint)
+    def update_setpoint(self):
+        """
+        move the setpoint along the ramp schedule, to where it should be
+        now, and check whether the temperature is stable; called by the
+        control loop at every tick
+        """
+        now=self.clock.time()
+        self.scheduleLock.acquire()
+        try:
+            self.advance_schedule(now)
+            if self.reached.isSet():
+                if abs(self.oven.T-self.setpoint)<=self.stableBand:
+                    if self.stableSince is None:
+                        self.stableSince=now
+                    if now-self.stableSince>=self.stableTime:
+                        self.stable.set()
+                else:
+                    self.stableSince=None
+        finally:
+            self.scheduleLock.release()
+    def advance_schedule(self,now):
+        if self.segment is None:
+            if not self.segments:
+                return
+            # coming out of idle, the setpoint may be far from the
+            # temperature; start the ramp from the temperature
+            self.start_segment(now,self.oven.T)
+        while True:
+            (t0,start,target,duration,hold,done)=self.segment
+            if now<t0+duration:
+                self.setpoint=start+(target-start)*(now-t0)/duration
+                return
+            self.setpoint=target
+            if not self.reached.isSet():
+                print("Ramp done; staying here for %d sec" % hold)
+                print(time.ctime(now))
+                self.reached.set()
+                done.set()
+            if now<t0+duration+hold:
+                return
+            if not self.segments:
+                self.segment=None
+                print("ramp series done; final setpoint: %g" % self.setpoint)
+                print(time.ctime(now))
+                self.idle.set()
+                return
+            # carry on from the end of this segment
+            self.start_segment(t0+duration+hold,target)
+    def start_segment(self,now,start):
+        """
+        take the next queued segment, ramping from start at time now
+        """
+        (target,duration,hold,done)=self.segments.pop(0)
+        self.segment=(now,start,target,duration,hold,done)
+        self.reached.clear()
+        self.stable.clear()
+        self.stableSince=None
+        print("Start ramp for: %s" % ((target,duration,hold),))
+        print(time.ctime(now))
+    def wait(self,event,timeout=None):
+        """
+        wait for event (self.reached, self.stable, self.idle or one
+        returned by appendSegment) on the control clock; returns whether it is set (False on timeout)
+        """
+        start=self.clock.time()
+        while not event.isSet():
+            if timeout is not None and self.clock.time()-start>=timeout:
+                return False
+            self.clock.sleep(1)
+        return True
     def ramp(self,target,duration):
         """
         change the setpoint slowly over time (in seconds) to ramp oven
-        temperature
+        temperature; returns once the setpoint is at target
         """
         # make sure that thread is running to maintain setpoint
-        assert self.isAlive()
-        # set the initial setpoint to current temperature if the thread
-        # is running to maintain setpoint, self.oven.T is a relatively
-        # current temperature; use that instead
-        self.setpoint=self.oven.T
-        print("New setpoint: %g" % self.setpoint)
-        print(time.ctime())
-        # plan on changing the setpoint by 1 degree at a time
-        diff=target-self.setpoint
-        tdelta=float(duration)/abs(diff)
-        # slowly change the setpoint; exit condition is given by sign of
-        # target-self.setpoint changing (until that changes, the
-        # quantity below should be a positive number)
-        while diff*(target-self.setpoint) > 0:
-            time.sleep(tdelta)
-            self.setpoint+=1*diff/abs(diff)
-            print("New setpoint: %g" % self.setpoint)
-            print(time.ctime())
-        # with the loop over, put the setpoint at the target, precisely
-        self.setpoint=target
-        print("Final setpoint: %g" % self.setpoint)
+        assert self.controlThread.isAlive()
+        self.wait(self.appendSegment(target,duration))
     def rampSeries(self,series):
         """
         program and run a series of ramps; series is a list of tuples,
         each tuple specifying the following: (target, duration, stay);
         target and duration are as defined in ramp, stay defines how
         long to stay at the target temperature before moving on to the
-        next point in the series.        
+        next point in the series. Returns when the series is done.
         """
+        assert self.controlThread.isAlive()
         print("Starting on ramp series with:\n")
         print(series)
-        print(time.ctime())
+        print(time.ctime(self.clock.time()))
         for point in series:
-            print("Start ramp for: ")
-            print(point)
-            self.ramp(point[0],point[1])
-            print("Ramp done; staying here for %d sec" % point[2])
-            print(time.ctime())
-            time.sleep(point[2])
-        print("ramp series done; final setpoint: %g" % self.setpoint)
-        print(time.ctime())
+            self.appendSegment(*point)
+        self.wait(self.idle)
+
+class MultiOvenControl(threading.Thread):
+    """
+    controls several heater zones (a second cell oven, a heated window,
+    ...) from one thread. Each zone is an OvenControl, not started
+    itself, for an Oven with its own thermocouple device or channel and
+    relay port; the Ovens share one TCWorker. The zones due for a
+    reading are read together in one job of the worker (in 'burst'
+    mode, see readTemperatures), and the relays switched as each zone's
+    controller decides. Ramps, events and autotune work on each zone as
+    with a single OvenControl.
+
+        worker=TCWorker()
+        worker.start()
+        cell=OvenControl(Oven(worker,port=1),"cell.txt")
+        window=OvenControl(Oven(worker,device=findTCs()[1],port=2),
+                           "window.txt")
+        control=MultiOvenControl([cell,window])
+        control.start()
+        cell.appendSegment(80,3600,7200)
+        window.appendSegment(90,3600,7200)
+    """
+    def __init__(self,zones,clock=None):
+        """
+        zones: OvenControl objects to run
+        clock: provides time() and sleep(); default is the first zone's
+        """
+        self.zones=list(zones)
+        if clock is None:
+            clock=self.zones[0].clock
+        self.clock=clock
+        for zone in self.zones:
+            zone.controlThread=self
+        # for each zone, when its next reading is due, and when to switch
+        # its relay off (None: not in this PWM period)
+        self.due=[0.]*len(self.zones)
+        self.offAt=[None]*len(self.zones)
+        threading.Thread.__init__(self)
+    def run(self):
+        """
+        poll the zones until self.running is set to False
+        """
+        self.running=True
+        while self.running:
+            try:
+                self.poll()
+            except:
+                print("maintaining setpoints failed, trying to continue (turning off ovens for now)")
+                for zone in self.zones:
+                    zone.oven.offRelay()
+                self.offAt=[None]*len(self.zones)
+                self.clock.sleep(1)
+    def poll(self):
+        """
+        one pass of the control loop: read the zones that are due and
+        take their control steps, switch off relays whose pulse is over,
+        then sleep until the next of these
+        """
+        due=[j for j in range(len(self.zones))
+             if self.clock.time()>=self.due[j]]
+        if due:
+            readTemperatures([self.zones[j].oven for j in due])
+            now=self.clock.time()
+            for j in due:
+                zone=self.zones[j]
+                zone.update_setpoint()
+                if zone.controller=='pid':
+                    self.offAt[j]=zone.pwm_start(zone.oven.T,now)
+                    self.due[j]=now+zone.period
+                else:
+                    zone.maintain_setpoint(zone.oven.T)
+                    self.due[j]=now+1
+                zone.log_state()
+        now=self.clock.time()
+        for j in range(len(self.zones)):
+            if self.offAt[j] is not None and now>=self.offAt[j]:
+                self.zones[j].oven.offRelay()
+                self.offAt[j]=None
+        wake=min(self.due+[t for t in self.offAt if t is not None])
+        self.clock.sleep(max(0.,wake-self.clock.time()))
@@ -0,0 +1,100 @@
+"""
+ellipticity and azimuth of the light from the PEM harmonics, vectorized
+over numpy arrays of readings (scalars work too).
+
+With the PEM at retardation A (radians), the detector sees, on top of
+the DC level z, a 1f component of amplitude 2 J1(A) z sin(2e) and a 2f
+component of 2 J2(A) z cos(2e) sin(2b) (e: ellipticity, b: azimuth).
+The lock-ins read rms values, hence the sqrt(2) below.
+
+    (e, b, ok1, ok2) = polarimetry.polarization(h1, h2, z)
+"""
+import math
+import numpy
+
+# retardation the PEM is run at (radians): the first zero of J0, where
+# the DC level does not depend on the retardation
+RETARDATION = 2.404826
+
+def besselJ(n, x):
+    """
+    Bessel function of the first kind of integer order n >= 0, by its
+    power series; good to better than 1e-12 for |x| < 5. x can be an
+    array.
+    """
+    x = numpy.asarray(x, dtype=float)
+    term = (x/2.)**n / math.factorial(n)
+    total = term
+    for k in range(1, 40):
+        term = term * -(x/2.)**2 / (k*(k+n))
+        total = total + term
+    return total
+
+def radians(setting):
+    """
+    retardation in radians for a PEM controller setting (waves x 1000)
+    """
+    return 2 * math.pi * numpy.asarray(setting, dtype=float) / 1000.
+
+def factors(retardation=RETARDATION):
+    """
+    (J1, J2) at retardation (radians)
+    """
+    return (besselJ(1, retardation), besselJ(2, retardation))
+
+def amplitude(x, mag=None):
+    """
+    harmonic amplitude from the lock-in readings: mag with the sign of
+    x where mag is given (not nan), x elsewhere
+    """
+    x = numpy.asarray(x, dtype=float)
+    if mag is None:
+        return x
+    mag = numpy.asarray(mag, dtype=float)
+    return numpy.where(numpy.isnan(mag), x, numpy.copysign(abs(mag), x))
+
+def arcsinMask(s):
+    """
+    0.5*arcsin(s), nan where |s| > 1; and the mask of valid values
+    """
+    s = numpy.asarray(s, dtype=float)
+    valid = numpy.isfinite(s) & (abs(s) <= 1.)
+    result = numpy.empty(s.shape)
+    result[valid] = 0.5 * numpy.arcsin(s[valid])
+    result[~valid] = numpy.nan
+    return (result, valid)
+
+def ellipticity(h1, z, retardation=RETARDATION):
+    """
+    ellipticity (radians) from the rms 1f amplitude h1 and the DC level
+    z (its sign does not matter here); returns (ellipticity, valid), nan
+    where the ratio is out of range
+    """
+    (J1, J2) = factors(retardation)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return arcsinMask(numpy.asarray(h1, dtype=float) /
+                          (abs(numpy.asarray(z, dtype=float)) *
+                           J1*math.sqrt(2)))
+
+def azimuth(h2, z, e, retardation=RETARDATION):
+    """
+    azimuth (radians) from the rms 2f amplitude h2, the DC level z (with
+    its sign) and the ellipticity e; returns (azimuth, valid)
+    """
+    (J1, J2) = factors(retardation)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return arcsinMask(numpy.asarray(h2, dtype=float) /
+                          (numpy.cos(2.*numpy.asarray(e, dtype=float)) *
+                           numpy.asarray(z, dtype=float) * J2*math.sqrt(2)))
+
+def polarization(h1, h2, z, retardation=RETARDATION):
+    """
+    ellipticity and azimuth from the rms 1f and 2f amplitudes and the DC
+    level (all arrays of the same shape, or scalars); returns
+    (ellipticity, azimuth, valid1, valid2), where valid1/valid2 mark the
+    points whose ellipticity/azimuth could be computed (the others are
+    nan)
+    """
+    (e, valid1) = ellipticity(h1, z, retardation)
+    (b, valid2) = azimuth(h2, z, e, retardation)
+    return (e, b, valid1, valid2 & valid1)
@@ -0,0 +1,883 @@
+"""
+in-process simulators of the instruments of this experiment, for
+benchmarking and testing without hardware.
+
+install() puts simulated serial, gpib, visa and usb modules in
+sys.modules, so that instruments, oven, kerrmonitor, lockin2all,
+lockinamp2x and pem can be imported and used unchanged:
+
+    import simulators
+    bench = simulators.install()
+    import kerrmonitor
+    kerrmonitor.polarization()
+
+The simulated instruments answer the commands used in this package,
+take time for every transaction (a fixed latency plus the bytes on the
+wire at the configured baud rate) and add that time to bench.stats.
+They all look at one Beam (the light reaching the detectors), so the
+numbers they return are consistent with each other.
+"""
+import sys, re, types, struct, array, math, random, threading
+import numpy
+import thermocouple
+import polarimetry
+from time import time as realtime, sleep as realsleep
+
+def checkSleep(seconds):
+    """
+    time.sleep raises IOError for a negative time (python 2); so do the
+    simulated clocks, so code that would fail on the real clock fails
+    here too
+    """
+    if seconds < 0:
+        raise IOError(22, 'Invalid argument')
+
+class RealClock:
+    """
+    wall-clock time; the default clock of the simulators
+    """
+    def time(self):
+        return realtime()
+    def sleep(self, seconds):
+        checkSleep(seconds)
+        if seconds > 0:
+            realsleep(seconds)
+
+class VirtualClock:
+    """
+    clock running rate times faster than the wall clock; sleep(dt)
+    takes dt/rate real seconds. Several threads can share it.
+    """
+    def __init__(self, rate=1., start=0.):
+        self.rate = float(rate)
+        self.start = start
+        self.real0 = realtime()
+    def time(self):
+        return self.start + (realtime() - self.real0) * self.rate
+    def sleep(self, seconds):
+        checkSleep(seconds)
+        if seconds > 0:
+            realsleep(seconds / self.rate)
+
+class Stats:
+    """
+    accumulates simulated I/O time and transactions, per device
+    """
+    def __init__(self):
+        self.reset()
+    def reset(self):
+        self.io = 0.
+        self.transactions = 0
+        self.devices = {}
+    def add(self, name, seconds, transactions=0):
+        self.io += seconds
+        self.transactions += transactions
+        (t, n) = self.devices.get(name, (0., 0))
+        self.devices[name] = (t + seconds, n + transactions)
+
+class Beam:
+    """
+    the light after the PEM and analyzer, as seen by the photodiode:
+    DC level z (volts), ellipticity and azimuth (radians), PEM
+    retardation (in waves x 1000, as set on the PEM controller) and
+    PEM frequency.
+    """
+    def __init__(self, dc=1.0, ellipticity=1e-3, azimuth=0.05,
+                 retardation=383., frequency=50e3, noise=1e-5):
+        self.dc = dc
+        self.ellipticity = ellipticity
+        self.azimuth = azimuth
+        self.retardation = retardation
+        self.frequency = frequency
+        # rms noise, in volts, of each detector reading
+        self.noise = noise
+    def amplitudes(self):
+        """
+        peak amplitudes of the 1f and 2f components of the signal
+        """
+        (J1, J2) = polarimetry.factors(polarimetry.radians(self.retardation))
+        e = self.ellipticity
+        a1 = 2 * J1 * self.dc * math.sin(2*e)
+        a2 = 2 * J2 * self.dc * math.cos(2*e) * \
+             math.sin(2*self.azimuth)
+        return (a1, a2)
+    def signal(self, t):
+        """
+        detector voltage at times t (numpy array, seconds)
+        """
+        (a1, a2) = self.amplitudes()
+        w = 2 * math.pi * self.frequency
+        return self.dc + a1*numpy.sin(w*t) + a2*numpy.cos(2*w*t)
+
+# base class of all simulated instruments
+class Device:
+    """
+    an instrument that answers commands. query() returns the response
+    to one command (None if there is none); latency is the time from
+    the end of a command to the start of its response.
+    """
+    name = 'device'
+    def __init__(self, bench, latency=0.005):
+        self.bench = bench
+        self.latency = latency
+    def query(self, cmd):
+        raise NotImplementedError
+
+# Tektronix TDS 2024 on RS-232
+class TDS2024(Device):
+    name = 'TDS 2024'
+    def __init__(self, bench, latency=0.01, trigRate=20.):
+        Device.__init__(self, bench, latency)
+        # channel 1: photodiode, channel 2: PEM 1f reference
+        self.scale = {1: 0.5, 2: 0.5, 3: 0.5, 4: 0.5}
+        self.position = {1: 0., 2: 0., 3: 0., 4: 0.}
+        self.hscale = 250e-6
+        self.hposition = 0.
+        self.source = 1
+        self.start = 1
+        self.stop = 2500
+        self.width = 1
+        self.mode = 'SAMPLE'
+        self.numavg = 16
+        self.trigRate = trigRate
+        self.t0 = bench.clock.time()
+    def seq(self):
+        return int((self.bench.clock.time() - self.t0) * self.trigRate)
+    def ymult(self):
+        return self.scale[self.source] / 25. / 256**(self.width-1)
+    def yoff(self):
+        return -self.position[self.source] * 25. * 256**(self.width-1)
+    def xincr(self):
+        return self.hscale * 10. / 2500
+    def xzero(self):
+        return self.hposition - 5 * self.hscale
+    def curve(self):
+        """
+        digitized record of the source channel, as a CURVe? block
+        """
+        n = numpy.arange(self.start - 1, self.stop)
+        t = self.xzero() + self.xincr() * n
+        beam = self.bench.beam
+        if self.source == 1:
+            v = beam.signal(t)
+        elif self.source == 2:
+            v = numpy.sin(2 * math.pi * beam.frequency * t)
+        else:
+            v = numpy.zeros(len(t))
+        noise = beam.noise * 100
+        if self.mode == 'AVERAGE':
+            noise /= math.sqrt(self.numavg)
+        v = v + numpy.random.normal(0., noise, len(t))
+        top = 2**(8*self.width - 1)
+        levels = numpy.clip(numpy.round(v/self.ymult() + self.yoff()),
+                            -top, top - 1)
+        data = levels.astype('>i'+str(self.width)).tostring()
+        size = str(len(data))
+        return '#' + str(len(size)) + size + data + '\n'
+    def query(self, line):
+        answers = []
+        prefix = ''
+        for part in line.split(';'):
+            part = part.strip()
+            if part.startswith(':'):
+                part = part[1:]
+            elif prefix:
+                part = prefix + part
+            (header, sep, arg) = part.partition(' ')
+            prefix = header[:header.rfind(':')+1]
+            answer = self.command(re.sub('[a-z]', '', header).upper(),
+                                  arg.strip())
+            if answer is not None:
+                answers.append(answer)
+        if not answers:
+            return None
+        if answers[-1].startswith('#'):
+            return ';'.join(answers)
+        return ';'.join(answers) + '\n'
+    def command(self, header, arg):
+        if header == '*IDN?':
+            return 'TEKTRONIX,TDS 2024,0,CF:91.1CT FV:v4.12 TDS2CM:CMV:v1.04'
+        elif header == 'ACQ:NUMAC?':
+            return str(self.seq())
+        elif header == 'ACQ:NUMAV?':
+            return str(self.numavg)
+        elif header == 'ACQ:NUMAV':
+            self.numavg = int(arg)
+        elif header == 'ACQ:MOD':
+            self.mode = 'AVERAGE' if arg.upper().startswith('AVE') \
+                        else 'SAMPLE'
+        elif header == 'DAT:SOU':
+            self.source = int(arg.upper().replace('CH', ''))
+        elif header == 'DAT:STAR':
+            self.start = int(arg)
+        elif header == 'DAT:STOP':
+            self.stop = int(arg)
+        elif header == 'DAT:WID':
+            self.width = int(arg)
+        elif header == 'DAT:ENC':
+            pass
+        elif header == 'WFMP:YMU?':
+            return '%.6E' % self.ymult()
+        elif header == 'WFMP:YOF?':
+            return '%.6E' % self.yoff()
+        elif header == 'WFMP:XZE?':
+            return '%.6E' % self.xzero()
+        elif header == 'WFMP:XIN?':
+            return '%.6E' % self.xincr()
+        elif header == 'HOR:MAI:SCA?':
+            return '%.6E' % self.hscale
+        elif header == 'HOR:MAI:POS?':
+            return '%.6E' % self.hposition
+        elif re.match('CH[1-4]:SCA\?$', header):
+            return '%.6E' % self.scale[int(header[2])]
+        elif re.match('CH[1-4]:POS\?$', header):
+            return '%.6E' % self.position[int(header[2])]
+        elif header == 'CURV?':
+            return self.curve()
+        else:
+            raise Exception, "TDS 2024 simulator: unknown command " + header
+
+# LakeShore 321 cryogenic temperature controller on RS-232
+class LakeShore321(Device):
+    name = 'LakeShore 321'
+    def __init__(self, bench, latency=0.05, T=300.):
+        Device.__init__(self, bench, latency)
+        # temperature in K
+        self.T = T
+    def query(self, cmd):
+        cmd = cmd.strip().upper()
+        if cmd == '*IDN?':
+            return 'LSCI,MODEL321,0,020399\r\n'
+        elif cmd == 'CDAT?':
+            return '%+.2f\r\n' % self.T
+        raise Exception, "LS321 simulator: unknown command " + cmd
+
+# Hinds PEM controller on RS-232
+class PEMController(Device):
+    name = 'PEM controller'
+    def __init__(self, bench, latency=0.1, wavelength=632.8):
+        Device.__init__(self, bench, latency)
+        self.wavelength = wavelength
+    def query(self, cmd):
+        cmd = cmd.strip().upper()
+        beam = self.bench.beam
+        if cmd == 'R':
+            return '%04d\r\n*' % round(beam.retardation)
+        elif cmd.startswith('R:'):
+            beam.retardation = float(cmd[2:])
+            return '*'
+        elif cmd == '1F':
+            return '%d\r\n*' % round(beam.frequency)
+        elif cmd == '2F':
+            return '%d\r\n*' % round(2*beam.frequency)
+        elif cmd == 'W':
+            return '%.1f\r\n*' % self.wavelength
+        raise Exception, "PEM simulator: unknown command " + cmd
+
+# HP 3478A multimeter (baratron voltage) on linux-gpib
+class HP3478A(Device):
+    name = 'HP 3478A'
+    def __init__(self, bench, latency=0.03, V=0.3):
+        Device.__init__(self, bench, latency)
+        self.V = V
+        self.display = ''
+    def query(self, cmd):
+        self.display = cmd.strip()
+        return None
+    def reading(self):
+        return '%+.5E\r\n' % (self.V + random.gauss(0., 1e-5))
+
+# DMM reading the DC level of the photodiode, on VISA
+class DCVoltmeter(Device):
+    name = 'DMM'
+    def query(self, cmd):
+        beam = self.bench.beam
+        return '%+.6E\n' % (beam.dc + random.gauss(0., beam.noise))
+
+# Signal Recovery 7265-style DSP lock-in amplifier, on VISA
+class Lockin(Device):
+    name = 'lock-in'
+    def __init__(self, bench, latency=0.02, tc=0.1, slope=1, sen=24,
+                 gains=None, phases=None):
+        """
+        tc: output filter time constant (sec)
+        slope: SLOPE setting; the filter has slope+1 RC poles
+        sen: SEN setting (24 is 100 mV full scale), for the curve buffer
+        """
+        Device.__init__(self, bench, latency)
+        self.tc = tc
+        self.slope = slope
+        self.sen = sen
+        # curve buffer: CBD bits, LEN, STR (sec), and when TD started
+        self.cbd = 1
+        self.length = 100
+        self.interval = 0.005
+        self.taken = None
+        # relative gain and signal phase (degrees) per harmonic
+        self.gains = gains or {1: 1., 2: 1.}
+        self.phases = phases or {1: 30., 2: 75.}
+        self.refn = 1
+        self.refp = 0.
+        # the outputs relax to their new values after a change
+        self.changed = bench.clock.time()
+        self.before = (0., 0.)
+    def target(self):
+        """
+        settled (X, Y) outputs, in rms volts
+        """
+        (a1, a2) = self.bench.beam.amplitudes()
+        a = {1: a1, 2: a2}.get(self.refn, 0.) / math.sqrt(2)
+        a *= self.gains.get(self.refn, 1.)
+        phi = math.radians(self.phases.get(self.refn, 0.) - self.refp)
+        return (a*math.cos(phi), a*math.sin(phi))
+    def outputs(self, t=None):
+        """
+        (X, Y) at time t (default: now)
+        """
+        if t is None:
+            t = self.bench.clock.time()
+        (x, y) = self.target()
+        # step response of slope+1 cascaded RC filters
+        elapsed = max(t - self.changed, 0.) / self.tc
+        (term, total) = (1., 1.)
+        for k in range(1, self.slope + 1):
+            term *= elapsed / k
+            total += term
+        decay = math.exp(-elapsed) * total
+        noise = self.bench.beam.noise / math.sqrt(self.tc)
+        x += (self.before[0] - x) * decay + random.gauss(0., noise)
+        y += (self.before[1] - y) * decay + random.gauss(0., noise)
+        return (x, y)
+    def change(self):
+        """
+        remember where the outputs were when a setting changed
+        """
+        self.before = self.outputs()
+        self.changed = self.bench.clock.time()
+    def query(self, cmd):
+        cmd = cmd.strip().upper()
+        (header, sep, arg) = cmd.partition(' ')
+        if header == '*IDN?':
+            return '7265\n'
+        elif header == 'REFN':
+            if not arg:
+                return '%d\n' % self.refn
+            self.change()
+            self.refn = int(arg)
+        elif header == 'AQN':
+            self.change()
+            # auto-phase leaves a small residual error
+            self.refp = self.phases.get(self.refn, 0.) + random.gauss(0., 0.1)
+        elif header == 'XY.':
+            return '%.4E,%.4E\n' % self.outputs()
+        elif header == 'MAG.':
+            (x, y) = self.outputs()
+            return '%.4E\n' % math.sqrt(x*x + y*y)
+        elif header == 'TC.':
+            return '%.4E\n' % self.tc
+        elif header == 'SEN':
+            if not arg:
+                return '%d\n' % self.sen
+            self.sen = int(arg)
+        elif header in ('CBD', 'LEN', 'STR'):
+            if not arg:
+                return '%d\n' % {'CBD': self.cbd, 'LEN': self.length,
+                                  'STR': int(self.interval*1000)}[header]
+            if header == 'CBD':
+                self.cbd = int(arg)
+            elif header == 'LEN':
+                self.length = int(arg)
+            else:
+                self.interval = int(arg) / 1000.
+        elif header == 'NC':
+            self.taken = None
+        elif header == 'TD':
+            self.taken = self.bench.clock.time()
+        elif header == 'M':
+            points = self.points()
+            running = int(self.taken is not None and points < self.length)
+            return '%d,%d,0,%d\n' % (running, int(points == self.length),
+                                     points)
+        elif header == 'DCB':
+            return self.curve(int(arg))
+        elif header == 'REFP.':
+            if not arg:
+                return '%.3f\n' % self.refp
+            self.change()
+            self.refp = float(arg)
+        elif header == 'SLOPE':
+            if not arg:
+                return '%d\n' % self.slope
+            self.change()
+            self.slope = int(arg)
+        else:
+            raise Exception, "lock-in simulator: unknown command " + cmd
+        return None
+
+    def points(self):
+        """
+        points stored in the curve buffer so far
+        """
+        if self.taken is None:
+            return 0
+        elapsed = self.bench.clock.time() - self.taken
+        return min(int(elapsed / self.interval) + 1, self.length)
+    def curve(self, bit):
+        """
+        stored points of curve bit, in binary (2 bytes each, MSB first)
+        """
+        full = (2, 5, 10)[(self.sen-1) % 3] * 10**((self.sen-1) // 3) * 1e-9
+        n = self.points()
+        t = self.taken + numpy.arange(n) * self.interval
+        # outputs() for all the sample times at once
+        (x, y) = self.target()
+        elapsed = numpy.maximum(t - self.changed, 0.) / self.tc
+        (term, total) = (numpy.ones(n), numpy.ones(n))
+        for k in range(1, self.slope + 1):
+            term = term * elapsed / k
+            total += term
+        decay = numpy.exp(-elapsed) * total
+        noise = self.bench.beam.noise / math.sqrt(self.tc)
+        x = x + (self.before[0] - x) * decay + numpy.random.normal(0., noise, n)
+        y = y + (self.before[1] - y) * decay + numpy.random.normal(0., noise, n)
+        if bit == 0:
+            values = x / full * 10000
+        elif bit == 1:
+            values = y / full * 10000
+        elif bit == 2:
+            values = numpy.hypot(x, y) / full * 10000
+        elif bit == 3:
+            values = numpy.degrees(numpy.arctan2(y, x)) * 100
+        elif bit == 4:
+            values = self.sen * numpy.ones(n)
+        elif bit == 5:
+            beam = self.bench.beam
+            values = (beam.dc + numpy.random.normal(0., beam.noise, n)) * 1000
+        else:
+            values = numpy.zeros(n)
+        values = numpy.clip(numpy.round(values), -32768, 32767)
+        return values.astype('>i2').tostring()
+
+# Measurement Computing USB-2001-TC thermocouple DAQ
+class USB2001TC(Device):
+    name = 'USB-2001-TC'
+    def __init__(self, bench, oven=None, latency=0.001):
+        """
+        oven: the Oven whose thermocouple this reads (on channel 0), or a
+              list of them, one per channel; bench.oven if None
+        """
+        Device.__init__(self, bench, latency)
+        if not isinstance(oven, (list, tuple)):
+            oven = [oven]
+        self.ovens = list(oven)
+        self.response = ''
+        self.raw = struct.pack('=I', 0)
+    def configuration(self):
+        pass
+    def oven(self, channel):
+        if not (0 <= channel < len(self.ovens)):
+            raise Exception, "USB-2001-TC simulator: no channel %d" % channel
+        return self.ovens[channel] or self.bench.oven
+    def mV(self, channel=0):
+        """
+        type K thermocouple voltage of channel
+        """
+        oven = self.oven(channel)
+        return float(thermocouple.emf(oven.temperature()) -
+                     thermocouple.emf(oven.cjc)) + random.gauss(0., 0.002)
+    def control(self, requestType, request, value, index, data):
+        if requestType == 64:
+            # command string
+            cmd = str(data).upper()
+            m = re.match(r'(\??)AI\{(\d+)\}:(.*)$', cmd)
+            if m is None:
+                raise Exception, "USB-2001-TC simulator: unknown command " + cmd
+            (query, channel, rest) = (m.group(1), int(m.group(2)), m.group(3))
+            if query and rest == 'VALUE':
+                counts = int(round(self.mV(channel) * 2**19 / 73.125)) + 2**19
+                self.response = 'AI{%d}:VALUE=%d' % (channel, counts)
+                self.raw = struct.pack('=I', counts)
+            elif query and rest == 'CJC':
+                cjc = self.oven(channel).cjc
+                self.response = 'AI{%d}:CJC=%.2f' % (channel, cjc)
+                self.raw = struct.pack('=f', cjc)
+            elif not query and rest.startswith('SENSOR='):
+                self.oven(channel)
+                self.response = cmd
+            else:
+                raise Exception, "USB-2001-TC simulator: unknown command " + cmd
+            return len(data)
+        elif request == 0x80:
+            return array.array('B', self.response + '\0')
+        return array.array('B', self.raw)
+
+# SIIG USB hub, whose port power drives the oven heater relay
+class SIIGHub(Device):
+    name = 'SIIG hub'
+    def __init__(self, bench, latency=0.001):
+        Device.__init__(self, bench, latency)
+        self.ports = {}
+    def control(self, requestType, request, value, index, data):
+        if value == 8:
+            # USB_PORT_FEAT_POWER; SET_FEATURE is 3, CLEAR_FEATURE is 1
+            self.ports[index] = int(request == 3)
+            for oven in self.bench.ovens:
+                oven.setHeater(index, self.ports[index])
+        return 0
+
+class Oven:
+    """
+    oven at a fixed temperature; the heater relay is only recorded
+    """
+    def __init__(self, T=25., cjc=22.):
+        self.T = T
+        self.cjc = cjc
+        self.heater = {}
+    def temperature(self):
+        return self.T
+    def setHeater(self, port, state):
+        self.heater[port] = state
+
+class OvenPlant(Oven):
+    """
+    thermal model of the trash-can oven: a heater element (switched
+    by the relay on the hub port) heating the oven body, which loses
+    heat to the room. Temperatures follow the clock, so with a
+    VirtualClock hours of heating pass in seconds.
+    """
+    def __init__(self, T=25., cjc=22., ambient=None, power=500.,
+                 heaterMass=200., ovenMass=2500., coupling=5., loss=2.,
+                 port=1, clock=None):
+        """
+        T: initial temperature of oven and heater (degC)
+        cjc: cold junction temperature (degC)
+        ambient: room temperature (degC); default: T
+        power: heater power when the relay is on (W)
+        heaterMass, ovenMass: heat capacities (J/K)
+        coupling: heater to oven heat conductance (W/K)
+        loss: oven to room heat conductance (W/K)
+        port: hub port of the heater relay
+        clock: set by Bench if None
+        """
+        Oven.__init__(self, T, cjc)
+        if ambient is None:
+            ambient = T
+        self.ambient = ambient
+        self.heaterT = T
+        self.power = power
+        self.heaterMass = heaterMass
+        self.ovenMass = ovenMass
+        self.coupling = coupling
+        self.loss = loss
+        self.port = port
+        self.clock = clock
+        self.last = None
+        self.lock = threading.Lock()
+    def advance(self):
+        """
+        integrate the model up to the present
+        """
+        self.lock.acquire()
+        try:
+            now = self.clock.time()
+            if self.last is None:
+                self.last = now
+            on = self.heater.get(self.port, 0)
+            while now > self.last:
+                # time steps well below the heater's time constant
+                dt = min(now - self.last, 1.)
+                flow = self.coupling * (self.heaterT - self.T)
+                self.heaterT += dt * (on*self.power - flow) / self.heaterMass
+                self.T += dt * (flow - self.loss*(self.T - self.ambient)) \
+                          / self.ovenMass
+                self.last += dt
+        finally:
+            self.lock.release()
+    def temperature(self):
+        self.advance()
+        return self.T
+    def setHeater(self, port, state):
+        # the old relay state holds up to now
+        self.advance()
+        Oven.setHeater(self, port, state)
+
+class Bench:
+    """
+    all simulated instruments, by the address the code uses for them,
+    plus the shared clock, statistics and Beam.
+    """
+    def __init__(self, clock=None, beam=None, oven=None):
+        self.clock = clock or RealClock()
+        self.beam = beam or Beam()
+        # several ovens (heater zones) each get a USB-2001-TC, or share
+        # one on several channels if given as a tuple; the hub switches
+        # them all, and each heats on its own port
+        entries = oven
+        if not isinstance(entries, list):
+            entries = [oven or Oven()]
+        self.ovens = []
+        for entry in entries:
+            if isinstance(entry, tuple):
+                self.ovens.extend(entry)
+            else:
+                self.ovens.append(entry)
+        self.oven = self.ovens[0]
+        for oven in self.ovens:
+            if getattr(oven, 'clock', False) is None:
+                oven.clock = self.clock
+        self.stats = Stats()
+        self.serial = {'/dev/ttyUSB1': TDS2024(self),
+                       '/dev/ttyUSB0': LakeShore321(self),
+                       'Com4': PEMController(self)}
+        self.gpib = {'3478a': HP3478A(self)}
+        # GPIB::12 reads 2f high by the gain peaking that kerrmonitor
+        # corrects for with its 0.8472 factor; GPIB::13 (the borrowed
+        # lock-in) runs at a 10 s time constant
+        self.visa = {'GPIB::12': Lockin(self, gains={1: 1., 2: 1/0.8472}),
+                     'GPIB::13': Lockin(self, tc=10.),
+                     'GPIB::23': DCVoltmeter(self, latency=0.1)}
+        self.tcs = [USB2001TC(self, entry) for entry in entries]
+        self.usb = {(0x09db, 0x00f9): self.tcs[0],
+                    (0x2109, 0x3431): SIIGHub(self)}
+    def devices(self):
+        """
+        all simulated instruments, by address
+        """
+        result = {}
+        for table in (self.serial, self.gpib, self.visa):
+            result.update(table)
+        for (key, device) in self.usb.items():
+            result['USB::%04x:%04x' % key] = device
+        for (j, device) in enumerate(self.tcs[1:]):
+            result['USB::09db:00f9#%d' % (j+2)] = device
+        return result
+    def wait(self, device, seconds, transactions=0):
+        """
+        let simulated I/O take its time, and account for it
+        """
+        self.clock.sleep(seconds)
+        self.stats.add(device.name, seconds, transactions)
+
+# simulated pyserial
+class SerialException(Exception):
+    pass
+
+class Serial(object):
+    """
+    stand-in for serial.Serial connected to bench.serial[port]. Bytes
+    take 10 bits at the port's baud rate each way, and responses start
+    arriving the device's latency after the command.
+    """
+    bench = None
+    def __init__(self, port=None, baudrate=9600, bytesize=8, parity='N',
+                 stopbits=1, timeout=None, **kwargs):
+        if port not in self.bench.serial:
+            raise SerialException, "no simulated device on " + str(port)
+        self.port = port
+        self.device = self.bench.serial[port]
+        self.baudrate = baudrate
+        self.timeout = timeout
+        # responses not read yet: [start time, seconds per byte, data]
+        self.segments = []
+        # bytes of the first segment already read
+        self.offset = 0
+    def setTimeout(self, timeout):
+        self.timeout = timeout
+    def byteTime(self):
+        return 10. / self.baudrate
+    def write(self, data):
+        self.bench.wait(self.device, len(data) * self.byteTime())
+        for line in data.split('\n'):
+            if not line.strip():
+                continue
+            response = self.device.query(line.strip('\r'))
+            self.bench.stats.add(self.device.name, 0., 1)
+            if response:
+                start = self.bench.clock.time() + self.device.latency
+                if self.segments:
+                    (s, step, d) = self.segments[-1]
+                    start = max(start, s + step * len(d))
+                self.segments.append([start, self.byteTime(), response])
+        return len(data)
+    def arrived(self, t):
+        """
+        number of unread bytes that have arrived by time t
+        """
+        n = -self.offset
+        for (start, step, data) in self.segments:
+            if t < start + step:
+                break
+            n += min(len(data), int((t - start) / step))
+        return max(n, 0)
+    def due(self, n):
+        """
+        time when n unread bytes will have arrived, None if never
+        """
+        k = self.offset + n
+        for (start, step, data) in self.segments:
+            if k <= len(data):
+                return start + k * step
+            k -= len(data)
+        return None
+    def take(self, n):
+        out = []
+        while n > 0 and self.segments:
+            data = self.segments[0][2]
+            piece = data[self.offset:self.offset + n]
+            out.append(piece)
+            n -= len(piece)
+            self.offset += len(piece)
+            if self.offset == len(data):
+                self.segments.pop(0)
+                self.offset = 0
+        return ''.join(out)
+    def pending(self):
+        """
+        all unread data, arrived or not
+        """
+        return ''.join([s[2] for s in self.segments])[self.offset:]
+    def read(self, size=1):
+        if size <= 0:
+            return ''
+        now = self.bench.clock.time()
+        due = self.due(size)
+        if (due is None) or \
+               ((self.timeout is not None) and (due > now + self.timeout)):
+            if self.timeout is None:
+                raise SerialException, "read would block forever"
+            self.bench.wait(self.device, self.timeout)
+            size = self.arrived(self.bench.clock.time())
+        elif due > now:
+            self.bench.wait(self.device, due - now)
+        return self.take(size)
+    def readline(self):
+        n = self.pending().find('\n')
+        if n < 0:
+            return self.read(len(self.pending()) + 1)
+        return self.read(n + 1)
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+    def inWaiting(self):
+        return self.arrived(self.bench.clock.time())
+    def flushInput(self):
+        self.take(self.inWaiting())
+    def close(self):
+        pass
+
+# simulated linux-gpib
+def gpibFind(name):
+    return name
+def gpibRead(handle, size):
+    device = Serial.bench.gpib[handle]
+    data = device.reading()[:size]
+    Serial.bench.wait(device, device.latency + len(data) * 1e-6, 1)
+    return data
+def gpibWrite(handle, data):
+    device = Serial.bench.gpib[handle]
+    Serial.bench.wait(device, device.latency + len(data) * 1e-6, 1)
+    device.query(data)
+
+# simulated (old) pyvisa
+class Instrument:
+    """
+    stand-in for visa.instrument
+    """
+    def __init__(self, resource, **kwargs):
+        self.device = Serial.bench.visa[resource]
+        self.timeout = kwargs.get('timeout', 5)
+        self.response = ''
+    def write(self, cmd):
+        device = self.device
+        Serial.bench.wait(device, device.latency + len(cmd) * 1e-6, 1)
+        self.response = device.query(cmd) or ''
+    def read(self):
+        data = self.response
+        self.response = ''
+        Serial.bench.wait(self.device, len(data) * 1e-6)
+        return data.strip()
+    def read_raw(self):
+        data = self.response
+        self.response = ''
+        Serial.bench.wait(self.device, len(data) * 1e-6)
+        return data
+    def ask(self, cmd):
+        self.write(cmd)
+        return self.read()
+    def ask_for_values(self, cmd):
+        return [float(v) for v in re.split('[,;\s]+', self.ask(cmd)) if v]
+
+# simulated pyusb
+class USBDevice:
+    def __init__(self, device):
+        self.device = device
+    def set_configuration(self):
+        pass
+    def ctrl_transfer(self, requestType, request, value=0, index=0,
+                      data=None):
+        device = self.device
+        Serial.bench.wait(device, device.latency, 1)
+        return device.control(requestType, request, value, index, data)
+def usbFind(idVendor=None, idProduct=None, find_all=False, **kwargs):
+    device = Serial.bench.usb.get((idVendor, idProduct))
+    if device is None:
+        if find_all:
+            return iter([])
+        return None
+    if find_all:
+        if device is Serial.bench.tcs[0]:
+            return iter([USBDevice(tc) for tc in Serial.bench.tcs])
+        return iter([USBDevice(device)])
+    return USBDevice(device)
+
+def install(clock=None, latency=None, beam=None, oven=None):
+    """
+    replace the serial, gpib, visa and usb modules with simulated ones
+    (import the modules of this package afterwards).
+    clock: RealClock (default) or VirtualClock
+    latency: seconds; if given, overrides the latency of every device.
+             A dict by address (as in Bench.devices) sets them one by
+             one.
+    beam, oven: Beam and Oven (or OvenPlant) objects; defaults are
+                created if None. oven can be a list of them, one per
+                heater zone, each read by its own USB-2001-TC; a tuple
+                in the list shares one USB-2001-TC, on channels 0, 1, ...
+    returns the Bench; its instruments can be adjusted at any time.
+    """
+    bench = Bench(clock, beam, oven)
+    devices = bench.devices()
+    if isinstance(latency, dict):
+        for (address, value) in latency.items():
+            devices[address].latency = value
+    elif latency is not None:
+        for device in devices.values():
+            device.latency = latency
+    Serial.bench = bench
+
+    serialModule = types.ModuleType('serial')
+    serialModule.Serial = Serial
+    serialModule.SerialException = SerialException
+    gpibModule = types.ModuleType('gpib')
+    gpibModule.find = gpibFind
+    gpibModule.read = gpibRead
+    gpibModule.write = gpibWrite
+    visaModule = types.ModuleType('visa')
+    visaModule.instrument = Instrument
+    visaModule.Instrument = Instrument
+    usbModule = types.ModuleType('usb')
+    usbModule.core = types.ModuleType('usb.core')
+    usbModule.core.find = usbFind
+    usbModule.util = types.ModuleType('usb.util')
+    modules = {'serial': serialModule, 'gpib': gpibModule,
+               'visa': visaModule, 'usb': usbModule,
+               'usb.core': usbModule.core, 'usb.util': usbModule.util}
+    # instruments.py imports the lab's analysis package without using it
+    try:
+        import Silver.analysis
+    except ImportError:
+        modules['Silver'] = types.ModuleType('Silver')
+        modules['Silver'].analysis = types.ModuleType('Silver.analysis')
+        modules['Silver.analysis'] = modules['Silver'].analysis
+    sys.modules.update(modules)
+    return bench
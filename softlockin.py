@@ -0,0 +1,122 @@
+"""
+lock-in detection in software, of the photodiode waveforms read from
+the scope: all the PEM harmonics are demodulated at once from a single
+record, with the phase taken from the PEM reference on another
+channel, so no REFN switching or settling is needed.
+
+Records can be one waveform (1-d arrays) or a batch of them (2-d,
+records x samples, sharing the time axis, as kept by PlotStorage); the
+mixing for all records and harmonics is one matrix product.
+
+The PEM modulates the light as sin(A sin(wt)): odd harmonics go as
+sin(n w t) and even ones as cos(n w t), where sin(wt) is the reference.
+X of harmonic n is its rms amplitude on that term (what a lock-in
+phased on it reads), Y the quadrature, so X1 and X2 go straight into
+polarimetry:
+
+    scope = instruments.Scope(chs=(1,2))
+    (e, b, ok1, ok2) = softlockin.readPolarization(scope, 50e3)
+"""
+import math
+import numpy
+import polarimetry
+
+def window(n):
+    """
+    Hann window of n points; keeps the large DC level from leaking into
+    the harmonics when the record is not a whole number of periods
+    """
+    return 0.5 - 0.5*numpy.cos(2*math.pi*(numpy.arange(n) + 0.5)/n)
+
+def mix(t, v, frequencies):
+    """
+    complex peak amplitudes of v (records x samples, or one record) at
+    frequencies (Hz), on the time axis t: v ~ Re(c exp(2 pi i f t));
+    returns an array of (records x frequencies)
+    """
+    t = numpy.asarray(t, dtype=float)
+    w = window(len(t))
+    w *= 2. / w.sum()
+    # (samples x frequencies)
+    basis = w[:,None] * numpy.exp(-2j*math.pi*numpy.outer(t - t[0],
+                                                         frequencies))
+    # phases are counted from t[0], so the exponent stays small
+    shift = numpy.exp(-2j*math.pi*t[0]*numpy.asarray(frequencies, dtype=float))
+    return numpy.dot(numpy.asarray(v, dtype=float), basis) * shift
+
+def estimateFrequency(t, ref):
+    """
+    frequency (Hz) of the reference waveform ref (one record), from the
+    peak of its spectrum, interpolated between bins; a few Hz off for a
+    record of about a hundred periods. Use the PEM controller's reading
+    when it is known.
+    """
+    t = numpy.asarray(t, dtype=float)
+    ref = numpy.asarray(ref, dtype=float)
+    spectrum = abs(numpy.fft.rfft((ref - ref.mean()) * window(len(ref))))
+    k = numpy.argmax(spectrum[1:-1]) + 1
+    # parabola through the log magnitudes around the peak
+    (a, b, c) = numpy.log(spectrum[k-1:k+2] + 1e-300)
+    offset = 0.5 * (a - c) / (a - 2*b + c)
+    return (k + offset) / (len(ref) * (t[1] - t[0]))
+
+def harmonics(t, signal, ref, frequency=None, orders=(1, 2)):
+    """
+    demodulate signal at the harmonics orders of the reference ref (same
+    shapes: one record or records x samples). frequency: of the
+    reference (Hz); estimated from the first record if None.
+    Returns (dc, X, Y): dc the mean level (one per record), X and Y the
+    rms in-phase and quadrature amplitudes (records x orders, or orders
+    for one record)
+    """
+    t = numpy.asarray(t, dtype=float)
+    ref = numpy.asarray(ref, dtype=float)
+    if frequency is None:
+        frequency = estimateFrequency(t, ref.reshape(-1, len(t))[0])
+    orders = numpy.asarray(orders)
+    c = mix(t, signal, numpy.concatenate(([0.], frequency*orders)))
+    # ref = sin(wt + phi) has c = exp(i (phi - pi/2)); the signal phasors
+    # are turned to that phase
+    cref = mix(t, ref, [frequency])
+    turn = numpy.exp(-1j * orders * (numpy.angle(cref) + math.pi/2))
+    h = c[...,1:] * turn / math.sqrt(2)
+    # odd orders: on sin(n w t), v = -Im(c) sin + Re(c) cos
+    odd = (orders % 2 == 1)
+    X = numpy.where(odd, -h.imag, h.real)
+    Y = numpy.where(odd, h.real, h.imag)
+    return (c[...,0].real / 2, X, Y)
+
+def polarization(t, signal, ref, frequency=None,
+                 retardation=polarimetry.RETARDATION):
+    """
+    ellipticity and azimuth from the 1f and 2f harmonics of signal (see
+    harmonics); returns polarimetry.polarization's (ellipticity,
+    azimuth, valid1, valid2), one value per record
+    """
+    (dc, X, Y) = harmonics(t, signal, ref, frequency, (1, 2))
+    return polarimetry.polarization(X[...,0], X[...,1], dc, retardation)
+
+def readPolarization(scope, frequency=None, signal=1, reference=2,
+                     retardation=polarimetry.RETARDATION):
+    """
+    read one waveform from scope (an instruments.Scope reading both the
+    signal and the reference channels) and return its polarization (see
+    polarization)
+    """
+    (t, y) = scope.readWaveform()
+    return polarization(t, y[signal-1], y[reference-1], frequency,
+                        retardation)
+
+def storagePolarization(storage, frequency=None, signal=1, reference=2,
+                        retardation=polarimetry.RETARDATION):
+    """
+    polarization of every waveform kept in storage (an
+    instruments.PlotStorage that stores both the signal and the
+    reference channels), oldest first; returns arrays as polarization
+    """
+    n = storage.num()
+    t = storage.data[0][0]
+    y = storage.data[1].take(range(n))
+    return polarization(t, y[:,list(storage.chs).index(signal)],
+                        y[:,list(storage.chs).index(reference)],
+                        frequency, retardation)
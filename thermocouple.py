@@ -0,0 +1,132 @@
+"""
+type K thermocouple conversions (NIST ITS-90 polynomials), vectorized
+over numpy arrays of readings. Voltages are in mV, temperatures in
+degC.
+"""
+import numpy
+
+# inverse coefficients (mV -> degC), by voltage range
+RANGES=(
+    (-5.891,0.0),
+    (0.0,20.644),
+    (20.644,54.886));
+COEFFS=(
+    (0.0,25.173462,-1.1662878,-1.0833638,-0.89773540,
+     -0.37342377,-0.086632643,-0.010450598,-0.00051920577,0.0),
+    (0.0,25.08355,0.07860106,-0.2503131,0.08315270,
+     -0.01228034,0.0009804036,-0.00004413030,
+     1.057734E-06,-1.052755E-08),
+    (-131.8058,48.30222,-1.646031,0.05464731,-0.0009650715,
+     8.802193E-06,-3.110810E-08,0.0,0.0,0.0));
+# reference coefficients (degC -> mV), below and above 0 degC
+EMFCOEFFS=(
+    (0.0,0.394501280250E-01,0.236223735980E-04,-0.328589067840E-06,
+     -0.499048287770E-08,-0.675090591730E-10,-0.574103274280E-12,
+     -0.310888728940E-14,-0.104516093650E-16,-0.198892668780E-19,
+     -0.163226974860E-22),
+    (-0.176004136860E-01,0.389212049750E-01,0.185587700320E-04,
+     -0.994575928740E-07,0.318409457190E-09,-0.560728448890E-12,
+     0.560750590590E-15,-0.320207200030E-18,0.971511471520E-22,
+     -0.121047212750E-25,0.0));
+# exponential term of the reference function above 0 degC
+EMFEXP=(0.118597600000E+00,-0.118343200000E-03,0.126968600000E+03)
+
+def horner(coeffs, x):
+    """
+    evaluate the polynomial with coeffs (lowest order first) at x by
+    Horner's method
+    """
+    result = numpy.zeros(numpy.shape(x)) + coeffs[-1]
+    for c in coeffs[-2::-1]:
+        result *= x
+        result += c
+    return result
+
+def rangeIndex(mV):
+    """
+    index into RANGES for each voltage; the lower range wins on the
+    boundaries, and voltages outside use the nearest range
+    """
+    return numpy.searchsorted([r[1] for r in RANGES[:-1]], mV)
+
+def temperature(mV):
+    """
+    temperature difference across the thermocouple for voltage mV
+    (scalar or array). Voltages outside of RANGES use the nearest
+    range.
+    """
+    mV = numpy.asarray(mV, dtype=float)
+    j = rangeIndex(mV)
+    result = numpy.empty(mV.shape)
+    for k in range(len(RANGES)):
+        mask = (j == k)
+        result[mask] = horner(COEFFS[k], mV[mask])
+    return result
+
+def emf(T):
+    """
+    voltage of a thermocouple with its hot junction at T and cold
+    junction at 0 degC (scalar or array); the inverse of temperature
+    """
+    T = numpy.asarray(T, dtype=float)
+    result = numpy.empty(T.shape)
+    negative = T < 0
+    result[negative] = horner(EMFCOEFFS[0], T[negative])
+    positive = ~negative
+    (a0, a1, a2) = EMFEXP
+    Tp = T[positive]
+    result[positive] = horner(EMFCOEFFS[1], Tp) + \
+                       a0 * numpy.exp(a1 * (Tp - a2)**2)
+    return result
+
+def compensated(mV, cjc):
+    """
+    temperature of the hot junction, given the voltage mV and the cold
+    junction temperature cjc
+    """
+    return temperature(numpy.asarray(mV) + emf(cjc))
+
+class Table:
+    """
+    precomputed lookup table for temperature(), with linear
+    interpolation; the error is checked against the polynomials when
+    the table is built.
+    """
+    def __init__(self, lo=RANGES[0][0], hi=RANGES[-1][1], tolerance=1e-3):
+        """
+        lo, hi: voltage range covered (mV); outside of it, the table
+                returns the value at the nearest end.
+        tolerance: largest allowed interpolation error (degC)
+        """
+        nodes = []
+        values = []
+        self.error = 0.
+        # the polynomials do not quite join at the range boundaries, so
+        # each range is tabulated on its own
+        for (k, (r0, r1)) in enumerate(RANGES):
+            (a, b) = (max(lo, r0), min(hi, r1))
+            if a >= b:
+                continue
+            n = 16
+            while True:
+                mV = numpy.linspace(a, b, n+1)
+                T = horner(COEFFS[k], mV)
+                # interpolation error is largest between the nodes;
+                # check at the midpoints and at the quarter points
+                x = numpy.concatenate([mV[:-1] + f*(mV[1]-mV[0])
+                                       for f in (0.25, 0.5, 0.75)])
+                error = numpy.max(numpy.abs(numpy.interp(x, mV, T) -
+                                            horner(COEFFS[k], x)))
+                if error <= tolerance:
+                    break
+                n *= 2
+            if nodes:
+                # step over the boundary within a negligible interval
+                mV[0] += 1e-9
+            nodes.append(mV)
+            values.append(T)
+            self.error = max(self.error, error)
+        self.mV = numpy.concatenate(nodes)
+        self.T = numpy.concatenate(values)
+    def __call__(self, mV):
+        return numpy.interp(mV, self.mV, self.T)
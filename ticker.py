@@ -0,0 +1,99 @@
+"""
+waiting on a threading.Condition without a timeout, but still noticing
+timeouts and Ctrl-C.
+
+In python 2 a wait with a timeout polls, with sleeps growing up to 50
+ms, so it wakes up late by about as long as it has waited; a wait
+without one is exact, but cannot be interrupted. Here the waits have
+no timeout, and a Ticker thread wakes them up every interval sec to
+check the time (and let Ctrl-C through in the main thread).
+
+    condition.acquire()
+    try:
+        if not ticker.wait(condition,lambda: job.finished,10):
+            raise Exception, "timed out"
+    finally:
+        condition.release()
+"""
+import time, threading
+
+class Ticker(threading.Thread):
+    """
+    thread that notifies the conditions waited on through it every
+    interval sec (real time)
+    """
+    def __init__(self,interval=0.5):
+        threading.Thread.__init__(self)
+        self.daemon=True
+        self.interval=interval
+        # conditions waited on, with the number of waiters
+        self.conditions={}
+        self.lock=threading.Lock()
+        # just for sleeping; threading keeps the real time.sleep, even
+        # when the time module is replaced by a simulated clock
+        self.sleeper=threading.Event()
+    def add(self,condition):
+        self.lock.acquire()
+        try:
+            self.conditions[condition]=self.conditions.get(condition,0)+1
+        finally:
+            self.lock.release()
+    def remove(self,condition):
+        self.lock.acquire()
+        try:
+            self.conditions[condition]-=1
+            if self.conditions[condition]==0:
+                del self.conditions[condition]
+        finally:
+            self.lock.release()
+    def run(self):
+        while True:
+            self.sleeper.wait(self.interval)
+            self.lock.acquire()
+            try:
+                conditions=self.conditions.keys()
+            finally:
+                self.lock.release()
+            for condition in conditions:
+                condition.acquire()
+                try:
+                    condition.notifyAll()
+                finally:
+                    condition.release()
+
+def wait(condition,predicate,timeout=None):
+    """
+    with condition acquired, wait until predicate() is true, or timeout
+    sec (time.time) have passed; returns the last value of predicate()
+    """
+    if predicate():
+        return True
+    ticker=shared()
+    ticker.add(condition)
+    try:
+        start=time.time()
+        while not predicate():
+            if timeout is not None and time.time()-start>=timeout:
+                return False
+            condition.wait()
+        return True
+    finally:
+        ticker.remove(condition)
+
+__shared__=None
+__sharedLock__=threading.Lock()
+
+def shared():
+    """
+    the Ticker shared by the modules in this directory, started on
+    first use
+    """
+    global __shared__
+    __sharedLock__.acquire()
+    try:
+        if __shared__ is None:
+            __shared__=Ticker()
+            __shared__.start()
+        return __shared__
+    finally:
+        __sharedLock__.release()